@@ -1,5 +1,7 @@
 from django.shortcuts import render
 
+from uniworld import membership
+
 class Custom403Middleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -9,3 +11,13 @@ class Custom403Middleware:
         if response.status_code == 403:
             return render(request, '403.html', status=403)
         return response
+
+class MembershipCacheMiddleware:
+    """Memoizes course membership lookups for the duration of a request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with membership.request_cache():
+            return self.get_response(request)
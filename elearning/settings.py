@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 import ssl
 
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'elearning.middleware.MembershipCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'elearning.middleware.Custom403Middleware',
@@ -149,6 +151,12 @@ LOGOUT_REDIRECT_URL = 'home'
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# Media is permission-checked by Django and then, if set, sent by the front proxy:
+# 'x-accel-redirect' for nginx (an internal location at MEDIA_ACCEL_PREFIX aliased
+# to MEDIA_ROOT) or 'x-sendfile' for Apache mod_xsendfile and lighttpd
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 # LOGGING = {
 #     'version': 1,
 #     'disable_existing_loggers': False,
@@ -175,6 +183,37 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'send-notification-digests': {
+        'task': 'uniworld.tasks.send_notification_digests',
+        'schedule': 5 * 60,
+    },
+    'dispatch-enrollment-events': {
+        'task': 'uniworld.tasks.dispatch_enrollment_events',
+        'schedule': 60,
+    },
+    'process-submission-receipts': {
+        'task': 'uniworld.tasks.process_submission_receipts',
+        'schedule': 60,
+    },
+}
+
+# Submissions within this many minutes of an assignment's due date are queued
+# and expanded by a worker instead of being written in the request (None disables)
+SUBMISSION_QUEUE_WINDOW = 30
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
+if 'test' in sys.argv:
+    # Keep test runs from reading (or polluting) the shared Redis cache
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
 
 CHANNEL_LAYERS = {
     'default': {
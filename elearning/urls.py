@@ -15,14 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from uniworld.views import ProtectedMediaView
+
 urlpatterns = [
     path('', include("uniworld.urls")),
     path('chat/', include("chat.urls")),
     path('user/', include("users.urls")),
     path('admin/', admin.site.urls),
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:name>", ProtectedMediaView.as_view(), name='media'),
 ]
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,153 @@
+from datetime import timedelta
+from itertools import groupby
+from math import sqrt
+from operator import itemgetter
+
+from django.core.cache import cache
+
+from . import grading
+from .models import AssignmentQuestion, QuestionResponse
+
+ANALYSIS_CACHE_KEY = 'uniworld:item_analysis:v2:{}:{}'
+ANALYSIS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+FOLD_CHUNK_SIZE = 2000
+# Submissions are re-read this far behind the newest one folded, to catch
+# transactions that inserted earlier but committed later
+FOLD_OVERLAP = timedelta(minutes=10)
+DISTRIBUTION_BUCKETS = 10
+
+
+def _empty_state():
+    return {
+        # recorded_at of the newest submission folded, and the submissions folded within FOLD_OVERLAP of it
+        'latest': None,
+        'recent': {},
+        'submissions': 0,
+        # question id -> running sums over submissions; "rest" is the score on the other questions
+        'questions': {},
+        'distribution': [0] * DISTRIBUTION_BUCKETS,
+    }
+
+
+def _question_state():
+    return {'n': 0, 'correct': 0, 'rest': 0, 'rest_sq': 0, 'correct_rest': 0, 'options': {}}
+
+
+def _fold(state, answer_key, rows):
+    """
+    Add (submission id, recorded at, question id, option id) rows, ordered by
+    submission, to the running sums, skipping submissions already folded. Only
+    MCQ questions are analysed: essay scores are entered by hand later and
+    would invalidate sums that have been folded.
+    """
+    mcq = [question_id for question_id, question_type in answer_key.types.items() if question_type == 'MCQ']
+    possible = sum(answer_key.marks[question_id] for question_id in mcq)
+
+    for submission_id, group in groupby(rows, key=itemgetter(0)):
+        if submission_id in state['recent']:
+            continue
+        group = list(group)
+        recorded_at = group[0][1]
+        chosen = {question_id: option_id for _, _, question_id, option_id in group}
+        earned = {question_id: answer_key.score(question_id, chosen.get(question_id), None) for question_id in mcq}
+        total = sum(earned.values())
+
+        for question_id in mcq:
+            stats = state['questions'].setdefault(question_id, _question_state())
+            option_id = chosen.get(question_id)
+            correct = int(option_id in answer_key.correct.get(question_id, ()))
+            rest = total - earned[question_id]
+            stats['n'] += 1
+            stats['correct'] += correct
+            stats['rest'] += rest
+            stats['rest_sq'] += rest * rest
+            stats['correct_rest'] += correct * rest
+            stats['options'][option_id] = stats['options'].get(option_id, 0) + 1
+
+        if possible:
+            bucket = min(int(total / possible * DISTRIBUTION_BUCKETS), DISTRIBUTION_BUCKETS - 1)
+            state['distribution'][bucket] += 1
+        state['submissions'] += 1
+        state['recent'][submission_id] = recorded_at
+        if state['latest'] is None or recorded_at > state['latest']:
+            state['latest'] = recorded_at
+
+    if state['latest'] is not None:
+        cutoff = state['latest'] - FOLD_OVERLAP
+        state['recent'] = {pk: at for pk, at in state['recent'].items() if at >= cutoff}
+    return state
+
+
+def get_state(assignment):
+    """
+    Return (running sums, answer key) for an assignment, folding in only the
+    submissions recorded since the cached sums were last updated. The sums are
+    cached per answer key version, so a changed key starts again from scratch.
+
+    Neither ids nor timestamps are handed out in commit order, so each run
+    re-reads the last FOLD_OVERLAP of submissions and skips those it has
+    already folded, rather than trusting a strict "newer than" watermark.
+    """
+    answer_key = grading.get_answer_key(assignment.pk)
+    key = ANALYSIS_CACHE_KEY.format(assignment.pk, answer_key.version)
+    state = cache.get(key) or _empty_state()
+
+    rows = QuestionResponse.objects.filter(submission__assignment_id=assignment.pk)
+    if state['latest'] is not None:
+        rows = rows.filter(submission__recorded_at__gte=state['latest'] - FOLD_OVERLAP)
+    rows = rows.order_by('submission_id').values_list(
+        'submission_id', 'submission__recorded_at', 'question_id', 'selected_option_id'
+    )
+
+    folded = state['submissions']
+    _fold(state, answer_key, rows.iterator(chunk_size=FOLD_CHUNK_SIZE))
+    if state['submissions'] != folded:
+        cache.set(key, state, ANALYSIS_CACHE_TIMEOUT)
+    return state, answer_key
+
+
+def point_biserial(stats):
+    """Correlation between getting the question right and the score on the rest of the assignment."""
+    n, correct, rest = stats['n'], stats['correct'], stats['rest']
+    spread = (n * correct - correct * correct) * (n * stats['rest_sq'] - rest * rest)
+    if spread <= 0:
+        return None
+    return (n * stats['correct_rest'] - correct * rest) / sqrt(spread)
+
+
+def analyse(assignment):
+    """Difficulty, discrimination and distractor counts for each MCQ question, plus the score distribution."""
+    state, answer_key = get_state(assignment)
+    questions = AssignmentQuestion.objects.filter(
+        assignment_id=assignment.pk, question_type='MCQ'
+    ).prefetch_related('options').order_by('pk')
+
+    items = []
+    for question in questions:
+        stats = state['questions'].get(question.pk, _question_state())
+        n = stats['n']
+        items.append({
+            'question': question,
+            'responses': n,
+            'p_value': stats['correct'] / n if n else None,
+            'point_biserial': point_biserial(stats),
+            'options': [
+                {
+                    'option': option,
+                    'count': stats['options'].get(option.pk, 0),
+                    'share': stats['options'].get(option.pk, 0) / n if n else None,
+                }
+                for option in question.options.all()
+            ],
+            'unanswered': stats['options'].get(None, 0),
+        })
+
+    width = 100 // DISTRIBUTION_BUCKETS
+    return {
+        'submissions': state['submissions'],
+        'items': items,
+        'distribution': [
+            {'low': i * width, 'high': (i + 1) * width, 'count': count}
+            for i, count in enumerate(state['distribution'])
+        ],
+    }
@@ -0,0 +1,84 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import OuterRef, Q, Subquery
+
+from .models import Course, SearchEntry
+from .search import tokenize
+
+PREFIX_LENGTH = 2
+PREFIX_CACHE_KEY = 'uniworld:student_prefix:{}'
+EXCLUSION_CACHE_KEY = 'uniworld:roster_exclusion:{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+STUDENT_GROUP = 'students'
+
+
+def _prefixes(search_text):
+    prefixes = set()
+    for word in (search_text or '').split():
+        prefixes.update(word[:length] for length in range(1, PREFIX_LENGTH + 1))
+    return prefixes
+
+
+def _build_bucket(prefix):
+    User = get_user_model()
+    students = User.objects.filter(groups__name=STUDENT_GROUP).values('pk')
+    entries = SearchEntry.objects.filter(
+        Q(search_text__startswith=prefix) | Q(search_text__contains=f' {prefix}'),
+        kind='user',
+        object_id__in=students,
+    ).annotate(
+        email=Subquery(User.objects.filter(pk=OuterRef('object_id')).values('email')),
+    ).order_by('label').values_list('object_id', 'label', 'email', 'search_text')
+    return [(user_id, label, email, search_text.split()) for user_id, label, email, search_text in entries]
+
+
+def get_bucket(prefix):
+    """Students with a name or email word starting with prefix, sorted by label."""
+    key = PREFIX_CACHE_KEY.format(prefix)
+    bucket = cache.get(key)
+    if bucket is None:
+        bucket = _build_bucket(prefix)
+        cache.set(key, bucket, CACHE_TIMEOUT)
+    return bucket
+
+
+def invalidate_prefixes(*search_texts):
+    """Drop the buckets touched by a student's old and new search text."""
+    prefixes = set()
+    for search_text in search_texts:
+        prefixes |= _prefixes(search_text)
+    cache.delete_many([PREFIX_CACHE_KEY.format(prefix) for prefix in prefixes])
+
+
+def get_exclusions(course_id):
+    """Ids of users already enrolled in or blocked from the course."""
+    key = EXCLUSION_CACHE_KEY.format(course_id)
+    exclusions = cache.get(key)
+    if exclusions is None:
+        enrolled = Course.students.through.objects.filter(course_id=course_id).values_list('user_id')
+        blocked = Course.blocked_students.through.objects.filter(course_id=course_id).values_list('user_id')
+        exclusions = frozenset(user_id for user_id, in enrolled.union(blocked))
+        cache.set(key, exclusions, CACHE_TIMEOUT)
+    return exclusions
+
+
+def invalidate_exclusions(course_ids):
+    cache.delete_many([EXCLUSION_CACHE_KEY.format(course_id) for course_id in course_ids])
+
+
+def suggest_students(term, course_id, limit=10):
+    """Students matching every word of term by prefix who can still be added to the course."""
+    terms = tokenize(term)
+    if not terms:
+        return []
+
+    exclusions = get_exclusions(course_id)
+    results = []
+    for user_id, label, email, words in get_bucket(terms[0][:PREFIX_LENGTH]):
+        if user_id in exclusions:
+            continue
+        if all(any(word.startswith(t) for word in words) for t in terms):
+            results.append({'label': label, 'value': email})
+            if len(results) >= limit:
+                break
+    return results
@@ -0,0 +1,187 @@
+import codecs
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from mimetypes import guess_extension, guess_type
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIR = 'blobs'
+# Bytes kept from the start of each upload for content sniffing
+SNIFF_BYTES = 2048
+# How long an unreferenced blob is kept before garbage collection may delete it
+GC_GRACE = timedelta(hours=24)
+
+_SIGNATURES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1a\x45\xdf\xa3', 'video/webm'),
+]
+# Container formats whose members decide the real type, e.g. .docx and .pptx are zips
+_CONTAINERS = [
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+]
+
+
+def sniff(head, name=''):
+    """The MIME type of a file from its first bytes, using the name only to tell containers apart."""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+
+    guessed, _ = guess_type(name)
+    for signature, mime_type in _CONTAINERS:
+        if head.startswith(signature):
+            return guessed if guessed and guessed.startswith('application/') else mime_type
+
+    if b'\x00' in head:
+        return 'application/octet-stream'
+    try:
+        # Incremental, so a multi-byte character cut off at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        return 'application/octet-stream'
+    return guessed if guessed and guessed.startswith('text/') else 'text/plain'
+
+
+def blob_name(digest, mime_type):
+    # Fanned out over two directory levels to keep directories small
+    extension = guess_extension(mime_type) or ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names each file after the SHA-256 of its content.
+
+    Uploads are hashed and sniffed while they stream to a temporary file, then
+    moved into place under their digest, so identical uploads share one file
+    and one Blob row. Callers keep Blob.ref_count up to date with retain() and
+    release(); collect() deletes what nothing refers to any more.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks the real name from the content, and equal names mean equal files
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob  # Import here to avoid circular import
+
+        directory = self.path(BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+        sha256, size, head = hashlib.sha256(), 0, b''
+        temp = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False)
+        try:
+            with temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+
+            digest = sha256.hexdigest()
+            mime_type = sniff(head, name)
+            with transaction.atomic():
+                # The row lock orders this against collect(), so a blob being deleted is never reused
+                blob, created = Blob.objects.select_for_update().get_or_create(digest=digest, defaults={
+                    'name': blob_name(digest, mime_type),
+                    'size': size,
+                    'mime_type': mime_type,
+                    'unreferenced_since': timezone.now(),
+                })
+                if not created and blob.ref_count == 0:
+                    # Restart the grace period for a blob that is about to be referenced again
+                    Blob.objects.filter(pk=blob.pk).update(unreferenced_since=timezone.now())
+
+                path = self.path(blob.name)
+                if created or not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(temp.name, self.file_permissions_mode)
+                    os.replace(temp.name, path)
+        finally:
+            if os.path.exists(temp.name):
+                os.unlink(temp.name)
+        return blob.name
+
+
+def retain(name):
+    """Count one more reference to the blob stored under name, if it is one."""
+    from .models import Blob  # Import here to avoid circular import
+
+    if name:
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, unreferenced_since=None)
+
+
+def release(name):
+    """Drop a reference; the last one starts the blob's grace period."""
+    from .models import Blob  # Import here to avoid circular import
+
+    if name:
+        Blob.objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1,
+            unreferenced_since=Case(When(ref_count=1, then=Value(timezone.now())), default=F('unreferenced_since')),
+        )
+
+
+def collect(storage, grace=GC_GRACE, now=None, dry_run=False):
+    """
+    Delete blobs that have been unreferenced for longer than grace, plus files
+    under the blob directory that have no row at all (uploads from rolled back
+    transactions, or interrupted ones). Returns (blobs deleted, bytes freed).
+    """
+    from .models import Blob  # Import here to avoid circular import
+
+    now = now or timezone.now()
+    cutoff = now - grace
+    deleted, freed = 0, 0
+
+    candidates = Blob.objects.filter(ref_count=0, unreferenced_since__lte=cutoff).values_list('pk', flat=True)
+    for pk in list(candidates.iterator()):
+        with transaction.atomic():
+            # Re-check under the lock, in case the blob was uploaded or referenced again meanwhile
+            blob = Blob.objects.select_for_update().filter(
+                pk=pk, ref_count=0, unreferenced_since__lte=cutoff
+            ).first()
+            if blob is None:
+                continue
+            if not dry_run:
+                storage.delete(blob.name)
+                blob.delete()
+            deleted += 1
+            freed += blob.size
+
+    root = storage.path(BLOB_DIR)
+    known = set(Blob.objects.values_list('name', flat=True))
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name in known or stat.st_mtime > cutoff.timestamp():
+                continue
+            if not dry_run:
+                os.unlink(path)
+            freed += stat.st_size
+    return deleted, freed
@@ -0,0 +1,161 @@
+import hashlib
+import secrets
+import time
+from datetime import timezone as dt_timezone
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import membership
+from .models import Assignment
+
+FEED_KEY = 'uniworld:deadlines:{}'
+COURSE_VERSION_KEY = 'uniworld:deadline_version:{}'
+CALENDAR_TOKEN_KEY = 'uniworld:calendar_token:{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class Deadline(NamedTuple):
+    assignment_id: int
+    title: str
+    course_id: int
+    course_name: str
+    due_date: object
+
+
+def invalidate_course(course_id):
+    """Mark every feed that includes the course as stale, without touching the students' entries."""
+    key = COURSE_VERSION_KEY.format(course_id)
+    cache.set(key, time.time_ns(), None)
+    transaction.on_commit(lambda: cache.set(key, time.time_ns(), None))
+
+
+def _build(course_ids, now):
+    return [
+        Deadline(*row) for row in Assignment.objects.filter(
+            material__course__in=course_ids, due_date__gt=now
+        ).order_by('due_date', 'pk').values_list(
+            'pk', 'material__title', 'material__course_id', 'material__course__name', 'due_date'
+        )
+    ]
+
+
+def _entry(user_id, now):
+    """
+    The cached feed for a student, rebuilt only if their enrolments or any of
+    their courses' deadlines changed since it was stored. A warm entry costs
+    three cache reads and no queries.
+    """
+    enrolled = membership.get_index_for_id(user_id).enrolled
+    version_keys = {course_id: COURSE_VERSION_KEY.format(course_id) for course_id in enrolled}
+    stored_versions = cache.get_many(version_keys.values())
+    versions = {course_id: stored_versions.get(key) for course_id, key in version_keys.items()}
+
+    entry = cache.get(FEED_KEY.format(user_id))
+    if entry is None or entry['enrolled'] != enrolled or entry['versions'] != versions:
+        entry = {'enrolled': enrolled, 'versions': versions, 'deadlines': _build(enrolled, now)}
+        cache.set(FEED_KEY.format(user_id), entry, CACHE_TIMEOUT)
+    return entry
+
+
+def upcoming(user_id, limit=None, now=None):
+    """The student's deadlines that have not passed yet, soonest first."""
+    now = now or timezone.now()
+    deadlines = [deadline for deadline in _entry(user_id, now)['deadlines'] if deadline.due_date > now]
+    return deadlines[:limit] if limit else deadlines
+
+
+def calendar_etag(deadlines):
+    return hashlib.sha1(repr([tuple(deadline) for deadline in deadlines]).encode()).hexdigest()
+
+
+def _escape(text):
+    return (
+        str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    # RFC 5545 lines are at most 75 octets; continuations start with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(encoded):
+        end = start + (75 if not parts else 74)
+        # Never split a multi-byte character
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start = end
+    return '\r\n '.join(parts)
+
+
+def _timestamp(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_calendar(deadlines, url_for):
+    """An iCalendar document with one event per deadline; url_for(deadline) gives its link."""
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//UniWorld//Deadlines//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:UniWorld deadlines',
+    ]
+    for deadline in deadlines:
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:assignment-{deadline.assignment_id}@uniworld',
+            # Stable for an unchanged deadline, so the body matches its ETag
+            f'DTSTAMP:{_timestamp(deadline.due_date)}',
+            f'DTSTART:{_timestamp(deadline.due_date)}',
+            f'DTEND:{_timestamp(deadline.due_date)}',
+            f'SUMMARY:{_escape(deadline.title)} due',
+            f'DESCRIPTION:{_escape(deadline.course_name)}',
+            f'URL:{url_for(deadline)}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+def calendar_token(user):
+    """The secret that identifies the user's calendar feed, created on first use."""
+    from users.models import Profile  # Import here to avoid circular import
+
+    profile = user.profile
+    if not profile.calendar_token:
+        # update() so that only the token is written
+        profile.calendar_token = secrets.token_urlsafe(32)
+        Profile.objects.filter(pk=profile.pk).update(calendar_token=profile.calendar_token)
+    return profile.calendar_token
+
+
+def reset_calendar_token(user):
+    """Issue a new calendar secret; subscriptions using the old one stop working."""
+    from users.models import Profile  # Import here to avoid circular import
+
+    profile = user.profile
+    if profile.calendar_token:
+        cache.delete(CALENDAR_TOKEN_KEY.format(profile.calendar_token))
+    profile.calendar_token = secrets.token_urlsafe(32)
+    Profile.objects.filter(pk=profile.pk).update(calendar_token=profile.calendar_token)
+    return profile.calendar_token
+
+
+def user_for_token(token):
+    """Resolve a calendar secret to a user id, from the cache when possible."""
+    from users.models import Profile  # Import here to avoid circular import
+
+    key = CALENDAR_TOKEN_KEY.format(token)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = Profile.objects.filter(calendar_token=token).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            cache.set(key, user_id, CACHE_TIMEOUT)
+    return user_id
@@ -0,0 +1,128 @@
+import csv
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Course, EnrollmentImport
+from .tasks import notify_students_of_addition
+
+EMAIL_PATTERN = re.compile(r'[\w\.+-]+@[\w\.-]+')
+BATCH_SIZE = 500
+# Imports with more rows than this run in a Celery worker instead of the request
+ASYNC_THRESHOLD = 200
+
+
+def parse_pasted(text):
+    """Split a pasted list on commas, semicolons or newlines into (entry number, value) rows."""
+    entries = (entry.strip() for entry in re.split(r'[,;\n]', text or ''))
+    return [[number, entry] for number, entry in enumerate(filter(None, entries), start=1)]
+
+
+def parse_csv(uploaded_file):
+    """
+    Read (line number, value) rows from an uploaded CSV, taking the first cell
+    that looks like an email. A leading header row without an email is skipped.
+    """
+    try:
+        text = uploaded_file.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError("The uploaded file is not a UTF-8 encoded CSV.")
+
+    rows = []
+    for line, cells in enumerate(csv.reader(text.splitlines()), start=1):
+        cells = [cell.strip() for cell in cells if cell.strip()]
+        if not cells:
+            continue
+        value = next((cell for cell in cells if EMAIL_PATTERN.search(cell)), None)
+        if value is None and line == 1:
+            continue
+        rows.append([line, value or ', '.join(cells)])
+    return rows
+
+
+def create_import(course, user, rows):
+    return EnrollmentImport.objects.create(course=course, created_by=user, rows=rows, total=len(rows))
+
+
+def _process_batch(course, batch, seen):
+    """Enroll one batch of rows, returning (added user ids, error rows)."""
+    errors = []
+    emails = {}
+    for row, value in batch:
+        match = EMAIL_PATTERN.search(value)
+        if match is None:
+            errors.append({'row': row, 'value': value, 'error': "Not a valid email address."})
+        elif match.group() in seen:
+            errors.append({'row': row, 'value': value, 'error': f"Duplicate of row {seen[match.group()]}."})
+        else:
+            seen[match.group()] = row
+            emails[match.group()] = (row, value)
+
+    users = {}
+    for user_id, email in get_user_model().objects.filter(email__in=emails).values_list('pk', 'email'):
+        users.setdefault(email, []).append(user_id)
+
+    user_ids = [user_id for ids in users.values() for user_id in ids]
+    enrolled = set(Course.students.through.objects.filter(
+        course_id=course.pk, user_id__in=user_ids
+    ).values_list('user_id', flat=True))
+    blocked = set(Course.blocked_students.through.objects.filter(
+        course_id=course.pk, user_id__in=user_ids
+    ).values_list('user_id', flat=True))
+
+    added = []
+    for email, (row, value) in emails.items():
+        ids = users.get(email, [])
+        if not ids:
+            error = "No user with this email address."
+        elif len(ids) > 1:
+            error = "More than one user has this email address."
+        elif ids[0] in blocked:
+            error = "Student is blocked from this course."
+        elif ids[0] in enrolled:
+            error = "Student is already enrolled."
+        else:
+            added.append(ids[0])
+            continue
+        errors.append({'row': row, 'value': value, 'error': error})
+
+    if added:
+        # A single INSERT into the through table; m2m_changed keeps stats and caches current
+        course.students.add(*added)
+    return added, errors
+
+
+def run_import(enrollment_import):
+    """Process an import in batches, saving progress after each one so it can be polled."""
+    course = enrollment_import.course
+    # The teacher added these students, so the outbox doesn't tell them about it
+    course._roster_changed_by = enrollment_import.created_by
+    enrollment_import.status = 'running'
+    enrollment_import.save(update_fields=['status'])
+
+    added, seen = [], {}
+    try:
+        for start in range(enrollment_import.processed, enrollment_import.total, BATCH_SIZE):
+            batch = enrollment_import.rows[start:start + BATCH_SIZE]
+            with transaction.atomic():
+                batch_added, batch_errors = _process_batch(course, batch, seen)
+                added += batch_added
+                enrollment_import.processed = start + len(batch)
+                enrollment_import.added_count += len(batch_added)
+                enrollment_import.errors += sorted(batch_errors, key=lambda error: error['row'])
+                enrollment_import.save(update_fields=['processed', 'added_count', 'errors'])
+    except Exception:
+        enrollment_import.status = 'failed'
+        enrollment_import.finished_at = timezone.now()
+        enrollment_import.save(update_fields=['status', 'finished_at'])
+        raise
+
+    enrollment_import.status = 'done'
+    enrollment_import.finished_at = timezone.now()
+    enrollment_import.save(update_fields=['status', 'finished_at'])
+
+    if added:
+        transaction.on_commit(lambda: notify_students_of_addition.delay(course.pk, added))
+    return enrollment_import
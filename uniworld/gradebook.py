@@ -0,0 +1,91 @@
+import csv
+
+from django.db.models import FilteredRelation, Max, Q
+
+from . import xlsx
+from .models import Assignment
+from .rosters import ROSTER_ORDERING
+
+EXPORT_CHUNK_SIZE = 2000
+GRADEBOOK_PAGE_SIZE = 50
+# Text starting with these is evaluated as a formula when a spreadsheet opens the CSV
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def columns(course):
+    """The course's assignments in the order their materials appear."""
+    return list(
+        Assignment.objects.filter(material__course=course)
+        .select_related('material')
+        .order_by('material__sequence', 'pk')
+    )
+
+
+def _score_field(assignment):
+    return f'score_{assignment.pk}'
+
+
+def matrix(course, assignments, students=None):
+    """
+    The roster with one best-score annotation per assignment, so the whole
+    students x assignments grid comes back from a single grouped query.
+
+    Only graded submissions count; a student without one gets None.
+    """
+    if students is None:
+        students = course.students.all()
+    if not assignments:
+        return students.order_by(*ROSTER_ORDERING)
+
+    students = students.annotate(course_submissions=FilteredRelation(
+        'assignmentsubmission',
+        condition=Q(assignmentsubmission__assignment__in=[assignment.pk for assignment in assignments]),
+    ))
+    return students.annotate(**{
+        _score_field(assignment): Max(
+            'course_submissions__total_score',
+            filter=Q(course_submissions__assignment=assignment.pk),
+        )
+        for assignment in assignments
+    }).order_by(*ROSTER_ORDERING)
+
+
+def scores(student, assignments):
+    return [getattr(student, _score_field(assignment), None) for assignment in assignments]
+
+
+def header(assignments):
+    return ['Last name', 'First name', 'Email'] + [
+        f'{assignment.material.title} (/{assignment.total_marks()})' for assignment in assignments
+    ]
+
+
+def rows(course, assignments):
+    """Yield the header and one row per student, streaming the matrix from the database in chunks."""
+    yield header(assignments)
+    for student in matrix(course, assignments).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [student.last_name, student.first_name, student.email] + scores(student, assignments)
+
+
+class _Echo:
+    """csv.writer target that returns each line instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    # A leading quote makes spreadsheets show the value as text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def stream_csv(course):
+    writer = csv.writer(_Echo())
+    return (writer.writerow([_csv_cell(value) for value in row]) for row in rows(course, columns(course)))
+
+
+def stream_xlsx(course):
+    # Cells are written as inline strings, which spreadsheets never evaluate, so they need no escaping
+    return xlsx.stream_workbook(rows(course, columns(course)), sheet_name=course.name)
@@ -0,0 +1,322 @@
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Assignment, AssignmentQuestion, AssignmentSubmission, MCQOption, QuestionResponse
+
+ANSWER_KEY_VERSION_KEY = 'uniworld:answer_key_version:{}'
+ANSWER_KEY_CACHE_KEY = 'uniworld:answer_key:{}:{}'
+ANSWER_KEY_CACHE_TIMEOUT = 60 * 60 * 24
+REGRADE_LOCK_KEY = 'uniworld:regrade:{}'
+REGRADE_DELAY = 30
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+class AnswerKey(NamedTuple):
+    version: int = 0
+    marks: dict = {}        # question id -> marks
+    types: dict = {}        # question id -> 'MCQ' or 'ESSAY'
+    correct: dict = {}      # question id -> frozenset of correct option ids
+
+    @property
+    def total_marks(self):
+        return sum(self.marks.values())
+
+    def score(self, question_id, option_id, essay_score):
+        if self.types.get(question_id) == 'MCQ':
+            return self.marks[question_id] if option_id in self.correct.get(question_id, ()) else 0
+        return essay_score
+
+    def as_json(self):
+        """The form stored in Assignment.answer_key."""
+        return {
+            'total_marks': self.total_marks,
+            'questions': {
+                str(question_id): {
+                    'type': self.types[question_id],
+                    'marks': marks,
+                    'correct': sorted(self.correct.get(question_id, ())),
+                }
+                for question_id, marks in self.marks.items()
+            },
+        }
+
+    @classmethod
+    def from_json(cls, version, data):
+        questions = {int(question_id): question for question_id, question in data.get('questions', {}).items()}
+        return cls(
+            version,
+            {question_id: question['marks'] for question_id, question in questions.items()},
+            {question_id: question['type'] for question_id, question in questions.items()},
+            {question_id: frozenset(question['correct']) for question_id, question in questions.items() if question['correct']},
+        )
+
+
+# Process-local copies of answer keys, keyed by assignment id. An entry is
+# only used while its version matches the one published in the Django cache,
+# so a warm process checks a single small cache key per lookup.
+_memory = {}
+
+
+def build_answer_key(assignment_id):
+    questions = AssignmentQuestion.objects.filter(assignment_id=assignment_id).values_list(
+        'pk', 'question_type', 'marks'
+    )
+    correct = {}
+    for question_id, option_id in MCQOption.objects.filter(
+        question__assignment_id=assignment_id, is_correct=True
+    ).values_list('question_id', 'pk'):
+        correct.setdefault(question_id, set()).add(option_id)
+
+    marks, types = {}, {}
+    for question_id, question_type, question_marks in questions:
+        marks[question_id] = question_marks
+        types[question_id] = question_type
+    return AnswerKey(0, marks, types, {
+        question_id: frozenset(ids) for question_id, ids in correct.items() if question_id in marks
+    })
+
+
+def _publish(assignment_id, answer_key):
+    _memory[assignment_id] = answer_key
+    cache.set_many({
+        ANSWER_KEY_VERSION_KEY.format(assignment_id): answer_key.version,
+        ANSWER_KEY_CACHE_KEY.format(assignment_id, answer_key.version): answer_key,
+    }, ANSWER_KEY_CACHE_TIMEOUT)
+    return answer_key
+
+
+def get_answer_key(assignment):
+    """
+    Return the answer key for an Assignment or assignment id, from memory, the
+    Django cache, or the denormalised copy on the Assignment row, in that order.
+    """
+    if isinstance(assignment, Assignment):
+        assignment_id, loaded = assignment.pk, assignment
+    else:
+        assignment_id, loaded = assignment, None
+
+    version = cache.get(ANSWER_KEY_VERSION_KEY.format(assignment_id))
+    if version is not None:
+        local = _memory.get(assignment_id)
+        if local is not None and local.version == version:
+            return local
+        answer_key = cache.get(ANSWER_KEY_CACHE_KEY.format(assignment_id, version))
+        if answer_key is not None:
+            _memory[assignment_id] = answer_key
+            return answer_key
+
+    if loaded is None:
+        loaded = Assignment.objects.only('answer_key', 'answer_key_version').get(pk=assignment_id)
+    return _publish(assignment_id, AnswerKey.from_json(loaded.answer_key_version, loaded.answer_key))
+
+
+def invalidate_answer_key(assignment_id):
+    key = ANSWER_KEY_VERSION_KEY.format(assignment_id)
+    cache.delete(key)
+    # Drop it again once the new version is visible to other connections
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def refresh_answer_key(assignment_id):
+    """
+    Rebuild the key from the questions and options and store it on the
+    Assignment with a new version, returning True if grading would now give
+    different results.
+    """
+    answer_key = build_answer_key(assignment_id).as_json()
+    with transaction.atomic():
+        stored = Assignment.objects.select_for_update().filter(pk=assignment_id).values_list(
+            'answer_key', flat=True
+        ).first()
+        if stored is None or stored == answer_key:
+            return False
+        Assignment.objects.filter(pk=assignment_id).update(
+            answer_key=answer_key, answer_key_version=F('answer_key_version') + 1
+        )
+    invalidate_answer_key(assignment_id)
+    return True
+
+
+def score_responses(answer_key, rows):
+    """
+    Score compact (response id, submission id, question id, option id, stored score)
+    rows, returning ({submission id: total}, {response id: new MCQ score} for changed
+    rows, {ids of submissions with essays still to mark}).
+    """
+    totals, changed, ungraded = {}, {}, set()
+    for response_id, submission_id, question_id, option_id, stored in rows:
+        score = answer_key.score(question_id, option_id, stored)
+        if answer_key.types.get(question_id) == 'MCQ':
+            if score != stored:
+                changed[response_id] = score
+        elif score is None:
+            ungraded.add(submission_id)
+        totals[submission_id] = totals.get(submission_id, 0) + (score or 0)
+    return totals, changed, ungraded
+
+
+def grade_submissions(assignment_id, submissions=None):
+    """
+    Score the given submissions of an assignment (all of them by default) in one
+    pass over their responses and write the totals back with bulk_update. Like
+    apply_grades, a submission with essays still to mark keeps its total empty.
+    """
+    if submissions is None:
+        submissions = AssignmentSubmission.objects.filter(assignment_id=assignment_id)
+    submissions = {submission.pk: submission for submission in submissions.only('pk', 'total_score')}
+    if not submissions:
+        return 0
+
+    rows = QuestionResponse.objects.filter(submission_id__in=submissions).values_list(
+        'pk', 'submission_id', 'question_id', 'selected_option_id', 'score'
+    )
+    totals, changed, ungraded = score_responses(get_answer_key(assignment_id), rows.iterator())
+
+    updated = []
+    for pk, submission in submissions.items():
+        total = None if pk in ungraded else totals.get(pk, 0)
+        if submission.total_score != total:
+            submission.total_score = total
+            updated.append(submission)
+
+    with transaction.atomic():
+        QuestionResponse.objects.bulk_update(
+            [QuestionResponse(pk=pk, score=score) for pk, score in changed.items()],
+            ['score'],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+        AssignmentSubmission.objects.bulk_update(updated, ['total_score'], batch_size=BULK_UPDATE_BATCH_SIZE)
+    return len(updated)
+
+
+def regrade_assignment(assignment_id):
+    """Rescore every submission that has already been graded."""
+    cache.delete(REGRADE_LOCK_KEY.format(assignment_id))
+    graded = AssignmentSubmission.objects.filter(assignment_id=assignment_id, total_score__isnull=False)
+    return grade_submissions(assignment_id, graded)
+
+
+def schedule_regrade(assignment_id):
+    """Queue one regrade per REGRADE_DELAY seconds however many options or questions change."""
+    from .tasks import regrade_assignment_task  # Import here to avoid circular import
+
+    if cache.add(REGRADE_LOCK_KEY.format(assignment_id), True, REGRADE_DELAY * 2):
+        transaction.on_commit(
+            lambda: regrade_assignment_task.apply_async(args=[assignment_id], countdown=REGRADE_DELAY)
+        )
+
+
+def check_grades(scores, feedback=None):
+    """
+    Validate {response id: score} and {submission id: feedback} for any number
+    of submissions in at most two queries. Returns (ids of the courses they
+    belong to, [errors]).
+    """
+    course_ids, errors, found = set(), [], set()
+    responses = QuestionResponse.objects.filter(pk__in=scores).values_list(
+        'pk', 'submission__assignment__material__course_id', 'question__question_type', 'question__marks'
+    )
+    for pk, course_id, question_type, marks in responses:
+        found.add(pk)
+        course_ids.add(course_id)
+        if question_type == 'MCQ':
+            errors.append(f"Response {pk} is multiple choice and is scored from the answer key.")
+        elif not 0 <= scores[pk] <= marks:
+            errors.append(f"The score for response {pk} must be between 0 and {marks}.")
+    errors += [f"Response {pk} does not exist." for pk in sorted(set(scores) - found)]
+
+    if feedback:
+        submissions = dict(AssignmentSubmission.objects.filter(pk__in=feedback).values_list(
+            'pk', 'assignment__material__course_id'
+        ))
+        course_ids.update(submissions.values())
+        errors += [f"Submission {pk} does not exist." for pk in sorted(set(feedback) - set(submissions))]
+    return course_ids, errors
+
+
+def apply_grades(scores, feedback=None, grader=None, claimed_only=False):
+    """
+    Write essay scores and feedback for any number of submissions, recompute
+    their totals in one pass over their responses and notify each student
+    whose submission is now fully graded exactly once, after commit.
+
+    The scored responses are locked first. Responses under another grader's
+    live grading queue claim are left alone, and with claimed_only so is
+    anything the grader doesn't hold a live claim on themselves, so two
+    graders never score the same response. Scored responses are attributed
+    to the grader and released from their claim. Writes go through
+    bulk_update, so no post_save notifications are sent.
+
+    Returns (ids of the graded submissions, ids of the rejected responses).
+    """
+    from .tasks import notify_students_of_grades  # Import here to avoid circular import
+
+    feedback = feedback or {}
+    now = timezone.now()
+    with transaction.atomic():
+        responses = QuestionResponse.objects.select_for_update().filter(pk__in=scores)
+        if claimed_only:
+            responses = responses.filter(claimed_by=grader, claim_expires_at__gt=now)
+        else:
+            responses = responses.exclude(Q(claim_expires_at__gt=now), ~Q(claimed_by=grader))
+        accepted = dict(responses.values_list('pk', 'submission_id'))
+        rejected = sorted(set(scores) - set(accepted))
+        scores = {pk: score for pk, score in scores.items() if pk in accepted}
+
+        submission_ids = set(feedback) | set(accepted.values())
+        submissions = {
+            submission.pk: submission
+            for submission in AssignmentSubmission.objects.select_for_update().filter(pk__in=submission_ids).only(
+                'pk', 'assignment_id', 'total_score', 'feedback'
+            )
+        }
+
+        by_assignment = {}
+        rows = QuestionResponse.objects.filter(submission_id__in=submissions).values_list(
+            'pk', 'submission_id', 'question_id', 'selected_option_id', 'score'
+        )
+        for pk, submission_id, question_id, option_id, stored in rows:
+            by_assignment.setdefault(submissions[submission_id].assignment_id, []).append(
+                (pk, submission_id, question_id, option_id, scores.get(pk, stored))
+            )
+
+        totals, changed, ungraded = {}, {}, set()
+        for assignment_id, assignment_rows in by_assignment.items():
+            answer_key = get_answer_key(assignment_id)
+            assignment_totals, assignment_changed, assignment_ungraded = score_responses(answer_key, assignment_rows)
+            totals.update(assignment_totals)
+            changed.update(assignment_changed)
+            ungraded.update(assignment_ungraded)
+
+        graded = []
+        for pk, submission in submissions.items():
+            if pk in feedback:
+                submission.feedback = feedback[pk]
+            # A submission with essays still to mark keeps its total empty
+            submission.total_score = None if pk in ungraded else totals.get(pk, 0)
+            if submission.total_score is not None:
+                graded.append(pk)
+
+        QuestionResponse.objects.bulk_update(
+            [
+                QuestionResponse(pk=pk, score=score, graded_by=grader, graded_at=now, claimed_by=None, claim_expires_at=None)
+                for pk, score in scores.items()
+            ],
+            ['score', 'graded_by', 'graded_at', 'claimed_by', 'claim_expires_at'],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+        QuestionResponse.objects.bulk_update(
+            [QuestionResponse(pk=pk, score=score) for pk, score in changed.items() if pk not in scores],
+            ['score'],
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+        )
+        AssignmentSubmission.objects.bulk_update(
+            submissions.values(), ['total_score', 'feedback'], batch_size=BULK_UPDATE_BATCH_SIZE
+        )
+        if graded:
+            transaction.on_commit(lambda: notify_students_of_grades.delay(sorted(graded)))
+    return sorted(graded), rejected
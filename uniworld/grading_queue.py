@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import QuestionResponse
+
+# How long a claim is held before the responses go back to the pool
+LEASE = timedelta(minutes=15)
+CLAIM_SIZE = 10
+MAX_CLAIMED = 50
+
+
+def ungraded(course):
+    """Essay responses in the course still waiting for a score."""
+    return QuestionResponse.objects.filter(
+        submission__assignment__material__course=course,
+        question__question_type='ESSAY',
+        score__isnull=True,
+    )
+
+
+def _unclaimed(now):
+    return Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now)
+
+
+def active_claims(course, user, now=None):
+    now = now or timezone.now()
+    return ungraded(course).filter(claimed_by=user, claim_expires_at__gt=now).select_related(
+        'question', 'submission__student', 'submission__assignment__material'
+    ).order_by('pk')
+
+
+def claim(course, user, count=CLAIM_SIZE, now=None):
+    """
+    Lease up to count more ungraded responses to the user and renew the lease
+    on the ones they already hold. Returns how many were newly claimed.
+
+    Rows being claimed by another grader are skipped rather than waited on, so
+    graders working at the same time never block each other or get the same
+    response twice.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        held = ungraded(course).filter(claimed_by=user, claim_expires_at__gt=now).update(claim_expires_at=now + LEASE)
+        count = max(0, min(count, MAX_CLAIMED - held))
+        if not count:
+            return 0
+
+        ids = list(
+            ungraded(course).filter(_unclaimed(now))
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('pk')
+            .values_list('pk', flat=True)[:count]
+        )
+        # Re-check the lease in the UPDATE for databases without row locks
+        return QuestionResponse.objects.filter(_unclaimed(now), pk__in=ids, score__isnull=True).update(
+            claimed_by=user, claim_expires_at=now + LEASE
+        )
+
+
+def release(course, user):
+    """Hand the user's claims back to the pool."""
+    return ungraded(course).filter(claimed_by=user).update(claimed_by=None, claim_expires_at=None)
+
+
+def progress(course, now=None):
+    """Queue size and per-grader throughput over the last hour and day, in two grouped queries."""
+    now = now or timezone.now()
+    remaining = ungraded(course).aggregate(
+        total=Count('pk'),
+        claimed=Count('pk', filter=Q(claim_expires_at__gt=now)),
+    )
+    graders = QuestionResponse.objects.filter(
+        submission__assignment__material__course=course,
+        graded_by__isnull=False,
+        graded_at__gte=now - timedelta(days=1),
+    ).values('graded_by', 'graded_by__username', 'graded_by__first_name', 'graded_by__last_name').annotate(
+        last_hour=Count('pk', filter=Q(graded_at__gte=now - timedelta(hours=1))),
+        last_day=Count('pk'),
+    ).order_by('-last_day', 'graded_by')
+    return remaining, list(graders)
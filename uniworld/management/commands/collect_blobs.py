@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from uniworld import blobs
+from uniworld.models import Lecture
+
+class Command(BaseCommand):
+    help = 'Deletes stored lecture documents that no lecture has referred to for the grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=blobs.GC_GRACE.total_seconds() / 3600,
+            help='Only delete blobs unreferenced for at least this long',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        storage = Lecture._meta.get_field('document').storage
+        deleted, freed = blobs.collect(
+            storage, grace=timedelta(hours=options['grace_hours']), dry_run=options['dry_run']
+        )
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} blobs, freeing {freed} bytes'))
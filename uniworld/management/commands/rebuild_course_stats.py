@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from uniworld.models import Course, CourseStats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalised course statistics from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='*', type=int, help='Only rebuild stats for these courses')
+
+    def handle(self, *args, **options):
+        courses = Course.objects.all()
+        if options['course_ids']:
+            courses = courses.filter(pk__in=options['course_ids'])
+
+        rebuilt = CourseStats.rebuild(courses)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt stats for {rebuilt} courses'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from uniworld import search
+
+class Command(BaseCommand):
+    help = 'Rebuilds the navbar search index from the Course and User tables'
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Successfully indexed {indexed} entries'))
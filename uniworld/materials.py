@@ -0,0 +1,43 @@
+from django.db import transaction
+
+from .models import CourseMaterial
+
+REORDER_BATCH_SIZE = 500
+
+
+def reorder(course, order):
+    """
+    Renumber the course's materials 1, 2, 3... in the order of the given ids,
+    which must name every material in the course exactly once. The rows are
+    locked while they are checked, so two teachers reordering at once can't
+    interleave, and only sequences that change are written, in one
+    bulk_update. Returns (number changed, [errors]); nothing is written if
+    there are errors.
+    """
+    with transaction.atomic():
+        materials = {
+            material.pk: material
+            for material in CourseMaterial.objects.select_for_update().filter(course=course).only('pk', 'sequence')
+        }
+
+        errors = []
+        seen = set()
+        for pk in order:
+            if pk in seen:
+                errors.append(f"Material {pk} appears more than once.")
+            elif pk not in materials:
+                errors.append(f"Material {pk} is not part of this course.")
+            seen.add(pk)
+        errors += [f"Material {pk} is missing from the ordering." for pk in sorted(set(materials) - seen)]
+        if errors:
+            return 0, errors
+
+        changed = []
+        for sequence, pk in enumerate(order, start=1):
+            material = materials[pk]
+            if material.sequence != sequence:
+                material.sequence = sequence
+                changed.append(material)
+        # Skips the post_save receivers on purpose: a new order is not new material to notify students about
+        CourseMaterial.objects.bulk_update(changed, ['sequence'], batch_size=REORDER_BATCH_SIZE)
+    return len(changed), []
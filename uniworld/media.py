@@ -0,0 +1,197 @@
+import hashlib
+import os
+import posixpath
+from mimetypes import guess_type
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import previews
+from .blobs import BLOB_DIR
+from .models import Course, CourseMaterial, Lecture
+from .previews import PREVIEW_DIR
+from users import avatars
+
+HOLDERS_KEY = 'uniworld:media_holders:{}'
+# Bounds how long a change of course or teacher can go unnoticed, other changes invalidate
+HOLDERS_TIMEOUT = 60 * 5
+LECTURE_PREFIXES = (f'{BLOB_DIR}/', 'lectures/')
+# Stored under their content hash, so they never change under the same name
+CONTENT_PREFIXES = (f'{BLOB_DIR}/', f'{PREVIEW_DIR}/')
+AVATAR_PREFIXES = ('profile_avatars/', f'{avatars.VARIANT_DIR}/')
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def _source(name):
+    """The document name, or for content-addressed files the prefix shared by a blob and its previews."""
+    if name.startswith(f'{PREVIEW_DIR}/'):
+        return previews.source_prefix(name)
+    if name.startswith(f'{BLOB_DIR}/'):
+        return os.path.splitext(name)[0]
+    return name
+
+
+def _holders_key(name):
+    return HOLDERS_KEY.format(hashlib.sha1(_source(name).encode()).hexdigest())
+
+
+def holders(name):
+    """(material id, course id, teacher id) for each lecture whose document is, or was rendered to, name."""
+    key = _holders_key(name)
+    rows = cache.get(key)
+    if rows is None:
+        source = _source(name)
+        if name.startswith(CONTENT_PREFIXES):
+            lectures = Lecture.objects.filter(document__startswith=source)
+        else:
+            lectures = Lecture.objects.filter(document=source)
+        rows = list(lectures.values_list('material_id', 'material__course_id', 'material__course__teacher_id'))
+        cache.set(key, rows, HOLDERS_TIMEOUT)
+    return rows
+
+
+def forget(names):
+    cache.delete_many([_holders_key(name) for name in names if name])
+
+
+def _material(material_id, course_id, teacher_id):
+    # Just enough of the material for its rules predicates, rebuilt from cached ids without queries
+    return CourseMaterial(pk=material_id, course=Course(pk=course_id, teacher=get_user_model()(pk=teacher_id)))
+
+
+def check_name(name):
+    """
+    Refuse names that aren't already in canonical form. Permissions are decided
+    by prefix, so 'profile_avatars/../lectures/x.pdf' must never reach storage,
+    which would resolve it to a lecture document.
+    """
+    if not name or name.startswith('/') or '..' in name.split('/') or posixpath.normpath(name) != name:
+        raise Http404("No such file.")
+    return name
+
+
+def can_read(user, name):
+    if name.startswith(LECTURE_PREFIXES + (f'{PREVIEW_DIR}/',)):
+        # A shared blob is readable by anyone who can view one of the lectures using it
+        return any(
+            user.has_perm(CourseMaterial.get_perm('view'), _material(*holder)) for holder in holders(name)
+        )
+    if name.startswith(AVATAR_PREFIXES) or name == avatars.DEFAULT_AVATAR:
+        return user.is_authenticated
+    return False
+
+
+class _Slice:
+    """Reads at most length bytes of a file from its current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _byte_range(request, size, etag, last_modified):
+    """
+    The (start, end) of a single satisfiable byte range, None to send the
+    whole file, or False if the range can't be satisfied.
+    """
+    header = request.headers.get('Range', '')
+    if not header.startswith('bytes=') or ',' in header:
+        # Multiple ranges are rare enough to answer with the whole file
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        return None
+
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            start, end = max(size - int(end), 0), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _transfer(request, name, path, size, etag, last_modified, content_type):
+    offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+    if offload == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+        return response
+    if offload == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    byte_range = _byte_range(request, size, etag, last_modified)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        file = open(path, 'rb')
+        file.seek(start)
+        response = FileResponse(_Slice(file, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def storage_for(name):
+    if name.startswith(LECTURE_PREFIXES):
+        return Lecture._meta.get_field('document').storage
+    return default_storage
+
+
+def serve(request, name, content_type=None):
+    """
+    Respond with a stored file, honouring conditional and Range requests.
+
+    With MEDIA_OFFLOAD set the proxy in front sends the file itself, via
+    X-Accel-Redirect (nginx, internal location at MEDIA_ACCEL_PREFIX) or
+    X-Sendfile (Apache, lighttpd), so the worker is free straight away.
+    Otherwise the whole file goes out as a FileResponse, which the server
+    can hand to sendfile().
+    """
+    check_name(name)
+    try:
+        path = storage_for(name).path(name)
+        stat = os.stat(path)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404("No such file.")
+
+    immutable = name.startswith(CONTENT_PREFIXES + (f'{avatars.VARIANT_DIR}/',))
+    last_modified = int(stat.st_mtime)
+    # Content-addressed names carry their digest, anything else is identified by its size and modification time
+    etag = quote_etag(os.path.splitext(os.path.basename(name))[0] if immutable else f'{last_modified:x}-{stat.st_size:x}')
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    content_type = content_type or guess_type(name)[0] or 'application/octet-stream'
+
+    if response is None:
+        response = _transfer(request, name, path, stat.st_size, etag, last_modified, content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else 'private, no-cache'
+    return response
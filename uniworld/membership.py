@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Value
+
+# Versioned with the fields of MembershipIndex, so entries in an older shape are never read
+CACHE_KEY = 'uniworld:membership:v2:{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# Per-request memo of user_id -> MembershipIndex, so that a page doing many
+# permission checks hits the cache only once. Outside of a request_cache()
+# block every lookup goes to the Django cache.
+_request_cache = ContextVar('uniworld_membership_cache', default=None)
+
+
+class MembershipIndex(NamedTuple):
+    enrolled: frozenset = frozenset()
+    blocked: frozenset = frozenset()
+    taught: frozenset = frozenset()
+    assisted: frozenset = frozenset()
+
+
+@contextmanager
+def request_cache():
+    token = _request_cache.set({})
+    try:
+        yield
+    finally:
+        _request_cache.reset(token)
+
+
+def _build_index(user_id):
+    from .models import Course  # Import here to avoid circular import
+
+    enrolled = Course.students.through.objects.filter(user_id=user_id).annotate(
+        relation=Value('enrolled')
+    ).values_list('course_id', 'relation')
+    blocked = Course.blocked_students.through.objects.filter(user_id=user_id).annotate(
+        relation=Value('blocked')
+    ).values_list('course_id', 'relation')
+    taught = Course.objects.filter(teacher_id=user_id).annotate(
+        relation=Value('taught')
+    ).values_list('pk', 'relation')
+    assisted = Course.assistants.through.objects.filter(user_id=user_id).annotate(
+        relation=Value('assisted')
+    ).values_list('course_id', 'relation')
+
+    course_ids = {'enrolled': set(), 'blocked': set(), 'taught': set(), 'assisted': set()}
+    for course_id, relation in enrolled.union(blocked, taught, assisted, all=True):
+        course_ids[relation].add(course_id)
+    return MembershipIndex(**{relation: frozenset(ids) for relation, ids in course_ids.items()})
+
+
+def get_index(user):
+    if user is None:
+        return MembershipIndex()
+    return get_index_for_id(user.pk)
+
+
+def get_index_for_id(user_id):
+    if user_id is None:
+        return MembershipIndex()
+
+    memo = _request_cache.get()
+    if memo is not None and user_id in memo:
+        return memo[user_id]
+
+    key = CACHE_KEY.format(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        index = _build_index(user_id)
+        cache.set(key, tuple(index), CACHE_TIMEOUT)
+    else:
+        index = MembershipIndex(*cached)
+
+    if memo is not None:
+        memo[user_id] = index
+    return index
+
+
+def invalidate(user_ids):
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+
+    memo = _request_cache.get()
+    if memo is not None:
+        for user_id in user_ids:
+            memo.pop(user_id, None)
+
+    keys = [CACHE_KEY.format(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Drop the entries again once the change is visible to other connections,
+    # in case another request rebuilt them from the old data in the meantime.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def is_enrolled(user, course_id):
+    return course_id in get_index(user).enrolled
+
+
+def is_blocked(user, course_id):
+    return course_id in get_index(user).blocked
+
+
+def is_teacher(user, course_id):
+    return course_id in get_index(user).taught
+
+
+def is_assistant(user, course_id):
+    return course_id in get_index(user).assisted
+
+
+def enrolled_course_ids(user, course_ids):
+    """Return the subset of course_ids the user is enrolled in."""
+    return get_index(user).enrolled.intersection(course_ids)
+
+
+def blocked_course_ids(user, course_ids):
+    """Return the subset of course_ids the user is blocked from."""
+    return get_index(user).blocked.intersection(course_ids)
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_course_stats(apps, schema_editor):
+    Course = apps.get_model('uniworld', 'Course')
+    CourseStats = apps.get_model('uniworld', 'CourseStats')
+
+    for course in Course.objects.all():
+        ratings = course.feedback.aggregate(
+            total=models.Sum('rating'),
+            count=models.Count('pk'),
+            latest=models.Max('created_at'),
+        )
+        CourseStats.objects.create(
+            course=course,
+            student_count=course.students.count(),
+            rating_sum=ratings['total'] or 0,
+            rating_count=ratings['count'],
+            feedback_count=ratings['count'],
+            last_activity=max(filter(None, [course.updated_at, ratings['latest']])),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0013_lecture_document_mime_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseStats',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='uniworld.course')),
+                ('student_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('feedback_count', models.PositiveIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(populate_course_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models, router
+
+ROSTER_ORDER_INDEX = models.Index(fields=['last_name', 'first_name', 'id'], name='uniworld_roster_order_idx')
+
+
+def add_roster_index(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    if router.allow_migrate_model(schema_editor.connection.alias, User):
+        schema_editor.add_index(User, ROSTER_ORDER_INDEX)
+
+
+def remove_roster_index(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    if router.allow_migrate_model(schema_editor.connection.alias, User):
+        schema_editor.remove_index(User, ROSTER_ORDER_INDEX)
+
+
+class Migration(migrations.Migration):
+    """
+    Supports keyset pagination of course rosters ordered by (last_name, first_name, id).
+
+    The auto-created through tables already carry a unique (course_id, user_id)
+    index for the join, so the roster query only needs the ordering index on
+    the user table.
+
+    This is a deliberate cross-app index: auth_user belongs to django.contrib.auth,
+    which uniworld cannot add Meta.indexes to, so the index lives here and is
+    deliberately kept out of the auth model state. It is created and dropped
+    through the schema editor so the DDL matches the backend (MySQL needs
+    DROP INDEX ... ON auth_user), and is skipped wherever the router keeps
+    auth off this database.
+    """
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('uniworld', '0014_coursestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_roster_index, remove_roster_index, hints={'model_name': 'user'}),
+    ]
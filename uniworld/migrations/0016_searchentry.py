@@ -0,0 +1,112 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:45
+
+import re
+
+from django.db import migrations, models
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE uniworld_searchentry_fts USING fts5("
+    "search_text, content='uniworld_searchentry', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER uniworld_searchentry_ai AFTER INSERT ON uniworld_searchentry BEGIN "
+    "INSERT INTO uniworld_searchentry_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER uniworld_searchentry_ad AFTER DELETE ON uniworld_searchentry BEGIN "
+    "INSERT INTO uniworld_searchentry_fts(uniworld_searchentry_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER uniworld_searchentry_au AFTER UPDATE ON uniworld_searchentry BEGIN "
+    "INSERT INTO uniworld_searchentry_fts(uniworld_searchentry_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO uniworld_searchentry_fts(rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS uniworld_searchentry_au",
+    "DROP TRIGGER IF EXISTS uniworld_searchentry_ad",
+    "DROP TRIGGER IF EXISTS uniworld_searchentry_ai",
+    "DROP TABLE IF EXISTS uniworld_searchentry_fts",
+]
+POSTGRES_TRIGRAM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX uniworld_searchentry_trgm_idx ON uniworld_searchentry USING gin (search_text gin_trgm_ops)",
+]
+POSTGRES_TRIGRAM_DROP = [
+    "DROP INDEX IF EXISTS uniworld_searchentry_trgm_idx",
+]
+
+
+def _execute(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_backend(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_FTS)
+    elif schema_editor.connection.vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_TRIGRAM)
+
+
+def drop_search_backend(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        _execute(schema_editor, SQLITE_FTS_DROP)
+    elif schema_editor.connection.vendor == 'postgresql':
+        _execute(schema_editor, POSTGRES_TRIGRAM_DROP)
+
+
+def _search_text(text):
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def populate_search_entries(apps, schema_editor):
+    Course = apps.get_model('uniworld', 'Course')
+    User = apps.get_model('auth', 'User')
+    SearchEntry = apps.get_model('uniworld', 'SearchEntry')
+
+    entries = [
+        SearchEntry(
+            kind='course',
+            object_id=course.pk,
+            label=course.name,
+            # Links are resolved from kind and object_id; the column is dropped in 0029
+            url='',
+            search_text=_search_text(course.name),
+        )
+        for course in Course.objects.all()
+    ]
+    entries += [
+        SearchEntry(
+            kind='user',
+            object_id=user.pk,
+            label=f"{user.first_name} {user.last_name} ({user.email})",
+            url='',
+            search_text=_search_text(f"{user.first_name} {user.last_name} {user.email}"),
+        )
+        for user in User.objects.filter(groups__name__in=['teachers', 'students']).distinct()
+    ]
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('uniworld', '0015_roster_ordering_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('course', 'Course'), ('user', 'User')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('label', models.CharField(max_length=512)),
+                ('url', models.CharField(max_length=255)),
+                ('search_text', models.CharField(db_index=True, max_length=512)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='uniworld_searchentry_unique_object'),
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(populate_search_entries, migrations.RunPython.noop),
+    ]
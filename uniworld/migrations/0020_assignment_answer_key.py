@@ -0,0 +1,44 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+def populate_answer_keys(apps, schema_editor):
+    Assignment = apps.get_model('uniworld', 'Assignment')
+
+    for assignment in Assignment.objects.prefetch_related('questions__options'):
+        questions = {
+            str(question.pk): {
+                'type': question.question_type,
+                'marks': question.marks,
+                'correct': sorted(option.pk for option in question.options.all() if option.is_correct),
+            }
+            for question in assignment.questions.all()
+        }
+        assignment.answer_key = {
+            'total_marks': sum(question['marks'] for question in questions.values()),
+            'questions': questions,
+        }
+        assignment.answer_key_version = 1
+        assignment.save(update_fields=['answer_key', 'answer_key_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0019_enrollmentevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='answer_key',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='answer_key_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_answer_keys, migrations.RunPython.noop),
+    ]
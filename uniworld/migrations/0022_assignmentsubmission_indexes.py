@@ -0,0 +1,27 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0021_submissionreceipt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignmentsubmission',
+            index=models.Index(fields=['assignment', 'submitted_at'], name='uniworld_sub_assign_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignmentsubmission',
+            index=models.Index(fields=['student', 'submitted_at'], name='uniworld_sub_student_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignmentsubmission',
+            index=models.Index(condition=models.Q(('total_score__isnull', True)), fields=['assignment', 'submitted_at'], name='uniworld_sub_pending_idx'),
+        ),
+    ]
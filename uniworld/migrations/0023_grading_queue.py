@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0022_assignmentsubmission_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='assistants',
+            field=models.ManyToManyField(blank=True, help_text="Teaching assistants who can grade this course's submissions.", related_name='assisted_courses', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='questionresponse',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionresponse',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='questionresponse',
+            name='graded_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionresponse',
+            name='graded_by',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='graded_responses', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='questionresponse',
+            index=models.Index(condition=models.Q(('score__isnull', True)), fields=['claim_expires_at'], name='uniworld_resp_ungraded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionresponse',
+            index=models.Index(fields=['graded_by', 'graded_at'], name='uniworld_resp_grader_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0023_grading_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assignment',
+            name='due_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
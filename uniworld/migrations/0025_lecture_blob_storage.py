@@ -0,0 +1,42 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:03
+
+import uniworld.blobs
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0024_assignment_due_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('mime_type', models.CharField(max_length=100)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('unreferenced_since', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lecture',
+            name='document_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='lecture',
+            name='document',
+            field=models.FileField(blank=True, null=True, storage=uniworld.blobs.ContentAddressedStorage(), upload_to='lectures/'),
+        ),
+        migrations.AlterField(
+            model_name='lecture',
+            name='document_mime_type',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0025_lecture_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coursematerial',
+            index=models.Index(fields=['course', 'sequence'], name='uniworld_material_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniworld', '0028_enrollmentevent_initiated_by'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='searchentry',
+            name='url',
+        ),
+    ]
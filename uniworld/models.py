@@ -2,28 +2,36 @@ from django.contrib.auth import get_user_model
 
 User = get_user_model()
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
 from rules import Predicate, is_group_member, always_deny, is_authenticated
 from rules.contrib.models import RulesModel
 from chat.models import Room
-from mimetypes import guess_type
+from uniworld import membership
+from uniworld.blobs import ContentAddressedStorage
+import os
+import uuid
 
 is_course_author = Predicate(lambda user, course: course.teacher == user)
-not_blocked = Predicate(lambda user, course: user not in course.blocked_students.all())
-is_enrolled = Predicate(lambda user, course: user in course.students.all())
-is_enrolled_material = Predicate(lambda user, material: user in material.course.students.all())
+not_blocked = Predicate(lambda user, course: not membership.is_blocked(user, course.pk))
+is_enrolled = Predicate(lambda user, course: membership.is_enrolled(user, course.pk))
+is_enrolled_material = Predicate(lambda user, material: membership.is_enrolled(user, material.course_id))
 is_course_author_material = Predicate(lambda user, material: user == material.course.teacher)
 is_course_author_question = Predicate(lambda user, question: user == question.assignment.material.course.teacher)
-is_enrolled_submission = Predicate(lambda user, submission: user in submission.assignment.material.course.students.all())
-is_enrolled_question = Predicate(lambda user, question: user in question.assignment.material.course.students.all())
+is_enrolled_submission = Predicate(lambda user, submission: membership.is_enrolled(user, submission.assignment.material.course_id))
+is_enrolled_question = Predicate(lambda user, question: membership.is_enrolled(user, question.assignment.material.course_id))
 is_course_author_mcq_option = Predicate(lambda user, option: user == option.question.assignment.material.course.teacher)
-is_enrolled_mcq_option = Predicate(lambda user, option: user in option.question.assignment.material.course.students.all())
+is_enrolled_mcq_option = Predicate(lambda user, option: membership.is_enrolled(user, option.question.assignment.material.course_id))
 is_course_author_submission = Predicate(lambda user, submission: user == submission.assignment.material.course.teacher)
-is_enrolled_response = Predicate(lambda user, response: user in response.submission.assignment.material.course.students.all())
+is_enrolled_response = Predicate(lambda user, response: membership.is_enrolled(user, response.submission.assignment.material.course_id))
 is_course_author_response = Predicate(lambda user, response: user == response.question.assignment.material.course.teacher)
 is_submission_author = Predicate(lambda user, submission: user == submission.student)
 is_response_author = Predicate(lambda user, response: user == response.submission.student)
 is_feedback_author = Predicate(lambda user, feedback: user == feedback.user)
 is_course_author_assignment = Predicate(lambda user, assignment: user == assignment.material.course.teacher)
+is_course_assistant = Predicate(lambda user, course: membership.is_assistant(user, course.pk))
+is_course_assistant_submission = Predicate(lambda user, submission: membership.is_assistant(user, submission.assignment.material.course_id))
 
 class Course(RulesModel):
     class Meta:
@@ -43,6 +51,7 @@ class Course(RulesModel):
             'block_student': is_course_author,
             'unblock_student': is_course_author,
             'add_submission': is_enrolled,
+            'grade_submissions': is_course_author | is_course_assistant,
         }
 
     name = models.CharField(max_length=200)
@@ -50,6 +59,10 @@ class Course(RulesModel):
     teacher = models.ForeignKey(User, on_delete=models.CASCADE)
     students = models.ManyToManyField(User, related_name='enrolled_courses', blank=True)
     blocked_students = models.ManyToManyField(User, related_name='blocked_courses', blank=True)
+    assistants = models.ManyToManyField(
+        User, related_name='assisted_courses', blank=True,
+        help_text="Teaching assistants who can grade this course's submissions.",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     chat_room = models.OneToOneField(Room, on_delete=models.CASCADE, null=True, related_name='course')
@@ -58,18 +71,24 @@ class Course(RulesModel):
         return self.name
 
     def student_count(self):
+        stats = self.get_stats()
+        if stats is not None:
+            return stats.student_count
         return self.students.count()
 
     # noinspection PyTypeChecker
     total_students = property(student_count)
 
     def enroll_student(self, user):
-        if user not in self.students.all():
+        if not membership.is_enrolled(user, self.pk):
             self.students.add(user)
             return True
         return False
 
     def average_rating(self):
+        stats = self.get_stats()
+        if stats is not None:
+            return stats.average_rating
         feedbacks = self.feedback.all()
         if feedbacks.exists():
             return round(feedbacks.aggregate(models.Avg('rating'))['rating__avg'], 1)
@@ -77,6 +96,191 @@ class Course(RulesModel):
 
     average_rating = property(average_rating)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored teacher so that a reassignment can invalidate both membership indexes
+        instance._loaded_teacher_id = instance.__dict__.get('teacher_id')
+        return instance
+
+    def get_stats(self):
+        # A missing row raises RelatedObjectDoesNotExist, which is also an AttributeError
+        return getattr(self, 'stats', None)
+
+class CourseStats(models.Model):
+    """Denormalised counters for a course, maintained by uniworld.signals."""
+
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    student_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    feedback_count = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Stats for {self.course_id}"
+
+    @property
+    def average_rating(self):
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
+        return 0
+
+    @staticmethod
+    def _student_count_subquery(course_ref):
+        enrollments = Course.students.through.objects.filter(course=models.OuterRef(course_ref))
+        return Coalesce(
+            models.Subquery(enrollments.values('course').annotate(total=models.Count('pk')).values('total')),
+            0,
+        )
+
+    @classmethod
+    def refresh_student_counts(cls, course_ids):
+        cls.objects.filter(course_id__in=course_ids).update(
+            student_count=cls._student_count_subquery('course_id'),
+        )
+
+    @classmethod
+    def rebuild(cls, courses=None):
+        """Recompute stats from the source tables, for all courses or the given queryset."""
+        if courses is None:
+            courses = Course.objects.all()
+
+        student_count = cls._student_count_subquery('pk')
+        feedback = Feedback.objects.filter(course=models.OuterRef('pk')).values('course')
+        rating_sum = feedback.annotate(total=models.Sum('rating')).values('total')
+        feedback_count = feedback.annotate(total=models.Count('pk')).values('total')
+        last_feedback = feedback.annotate(latest=models.Max('created_at')).values('latest')
+
+        courses = courses.annotate(
+            stats_student_count=student_count,
+            stats_rating_sum=Coalesce(models.Subquery(rating_sum), 0),
+            stats_feedback_count=Coalesce(models.Subquery(feedback_count), 0),
+            stats_last_feedback=models.Subquery(last_feedback),
+        )
+
+        stats = [
+            cls(
+                course=course,
+                student_count=course.stats_student_count,
+                rating_sum=course.stats_rating_sum,
+                rating_count=course.stats_feedback_count,
+                feedback_count=course.stats_feedback_count,
+                last_activity=max(filter(None, [course.updated_at, course.stats_last_feedback])),
+            )
+            for course in courses.iterator()
+        ]
+        cls.objects.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=['course'],
+            update_fields=['student_count', 'rating_sum', 'rating_count', 'feedback_count', 'last_activity'],
+        )
+        return len(stats)
+
+class SearchEntry(models.Model):
+    """Denormalised row backing the navbar search, maintained by uniworld.signals."""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='uniworld_searchentry_unique_object'),
+        ]
+
+    KINDS = [
+        ('course', 'Course'),
+        ('user', 'User'),
+    ]
+    # Resolved when results are shown, so renamed routes never leave stale links behind
+    URL_NAMES = {
+        'course': 'course-view',
+        'user': 'profile',
+    }
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    label = models.CharField(max_length=512)
+    search_text = models.CharField(max_length=512, db_index=True)
+
+    def __str__(self):
+        return self.label
+
+    def get_absolute_url(self):
+        return reverse(self.URL_NAMES[self.kind], args=[self.object_id])
+
+class EnrollmentImport(models.Model):
+    """A bulk enrollment request and its per-row report, processed by uniworld.enrollment."""
+
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='enrollment_imports')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enrollment_imports')
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    rows = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    added_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import of {self.total} student(s) into {self.course_id}"
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def progress(self):
+        if self.total:
+            return round(100 * self.processed / self.total)
+        return 100
+
+class EnrollmentEvent(models.Model):
+    """Outbox row written in the same transaction as a roster change, drained by uniworld.outbox."""
+
+    ACTIONS = [
+        ('enrolled', 'Enrolled'),
+        ('removed', 'Removed'),
+        ('blocked', 'Blocked'),
+    ]
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='enrollment_events')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enrollment_events')
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    # Who made the change, when known; tells a student leaving apart from being removed
+    initiated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.student_id} {self.action} in {self.course_id}"
+
+class PendingNotification(models.Model):
+    """A course event buffered for a student's next digest; repeats of the same key overwrite each other."""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'course', 'key'], name='uniworld_pendingnotification_unique_event'
+            ),
+        ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pending_notifications')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='pending_notifications')
+    key = models.CharField(max_length=100)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} for {self.recipient_id}"
+
 class Feedback(RulesModel):
     class Meta:
         rules_permissions = {
@@ -94,6 +298,13 @@ class Feedback(RulesModel):
     def __str__(self):
         return f"{self.user} - {self.course} - {self.rating}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so that edits can adjust CourseStats by the difference
+        instance._loaded_rating = instance.__dict__.get('rating')
+        return instance
+
 class CourseMaterial(RulesModel):
     class Meta:
         rules_permissions = {
@@ -103,6 +314,10 @@ class CourseMaterial(RulesModel):
         }
 
         ordering = ['sequence']
+        indexes = [
+            # Course listings are read in sequence order
+            models.Index(fields=['course', 'sequence'], name='uniworld_material_seq_idx'),
+        ]
 
     COURSE_MATERIAL_TYPES = [
         ('lecture', 'Lecture'),
@@ -114,17 +329,48 @@ class CourseMaterial(RulesModel):
     type = models.CharField(max_length=10, choices=COURSE_MATERIAL_TYPES)
     sequence = models.IntegerField()
 
+class Blob(models.Model):
+    """A file in content-addressed storage, stored once however many lectures use it."""
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    # Sniffed from the content when the blob is first stored
+    mime_type = models.CharField(max_length=100)
+    ref_count = models.PositiveIntegerField(default=0)
+    # Set while nothing refers to the blob; collect_blobs deletes it after a grace period
+    unreferenced_since = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
 class Lecture(models.Model):
     material = models.OneToOneField(CourseMaterial, on_delete=models.CASCADE, primary_key=True)
     content = models.TextField()
     video_url = models.URLField(blank=True, null=True)
-    document = models.FileField(upload_to='lectures/', null=True, blank=True)
-    document_mime_type = models.CharField(max_length=50, null=True, blank=True)
+    document = models.FileField(upload_to='lectures/', storage=ContentAddressedStorage(), null=True, blank=True)
+    document_mime_type = models.CharField(max_length=100, null=True, blank=True)
+    # Stored names are content hashes, so keep the uploaded one for downloads
+    document_name = models.CharField(max_length=255, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored document so that replacing it can release the old blob
+        instance._loaded_document = instance.__dict__.get('document')
+        return instance
 
     def save(self, *args, **kwargs):
-        if self.document:
-            mime_type, _ = guess_type(self.document.url)
-            self.document_mime_type = mime_type
+        if self.document and not self.document._committed:
+            # Store the upload first, so the row gets the type sniffed from its content
+            self.document_name = os.path.basename(self.document.name)
+            self.document.save(self.document.name, self.document.file, save=False)
+            self.document_mime_type = Blob.objects.filter(name=self.document.name).values_list(
+                'mime_type', flat=True
+            ).first()
+        elif not self.document:
+            self.document_mime_type = None
+            self.document_name = ''
         super().save(*args, **kwargs)
 
 class Assignment(RulesModel):
@@ -134,10 +380,13 @@ class Assignment(RulesModel):
         }
 
     material = models.OneToOneField(CourseMaterial, on_delete=models.CASCADE, primary_key=True)
-    due_date = models.DateTimeField()
+    due_date = models.DateTimeField(db_index=True)
+    # Denormalised by uniworld.grading whenever a question or option changes
+    answer_key = models.JSONField(default=dict, blank=True, editable=False)
+    answer_key_version = models.PositiveIntegerField(default=0, editable=False)
 
     def total_marks(self):
-        return self.questions.aggregate(total=models.Sum('marks'))['total'] or 0
+        return self.answer_key.get('total_marks', 0)
 
     def __str__(self):
         return f"Assignment for {self.material.title}"
@@ -183,33 +432,64 @@ class MCQOption(RulesModel):
 class AssignmentSubmission(RulesModel):
     class Meta:
         rules_permissions = {
-            'view': is_course_author_submission | is_submission_author,
-            'change': is_course_author_submission, # Update score
+            'view': is_course_author_submission | is_course_assistant_submission | is_submission_author,
+            'change': is_course_author_submission | is_course_assistant_submission, # Update score
             'delete': always_deny,
         }
+        indexes = [
+            models.Index(fields=['assignment', 'submitted_at'], name='uniworld_sub_assign_time_idx'),
+            models.Index(fields=['student', 'submitted_at'], name='uniworld_sub_student_time_idx'),
+            # Small, and serves both the pending filter and the pending counts
+            models.Index(
+                fields=['assignment', 'submitted_at'],
+                condition=models.Q(total_score__isnull=True),
+                name='uniworld_sub_pending_idx',
+            ),
+            models.Index(fields=['assignment', 'recorded_at'], name='uniworld_sub_recorded_idx'),
+        ]
 
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='submissions')
     student = models.ForeignKey(User, on_delete=models.CASCADE)
-    submitted_at = models.DateTimeField(auto_now_add=True)
+    # Set explicitly when a queued submission is expanded, so lateness uses the receipt time
+    submitted_at = models.DateTimeField(default=timezone.now, editable=False)
+    # When the row was inserted, which trails its commit by at most one transaction; uniworld.analysis folds by it
+    recorded_at = models.DateTimeField(auto_now_add=True)
     total_score = models.FloatField(null=True, blank=True)
     feedback = models.TextField(null=True, blank=True)
 
     def calculate_total_score(self):
-        total_score = 0
-        responses = self.responses.all()
-        for response in responses:
-            if response.question.question_type == 'MCQ':
-                if response.selected_option and response.selected_option.is_correct:
-                    total_score += response.question.marks
-            elif response.question.question_type == 'ESSAY':
-                if response.score is not None:
-                    total_score += response.score
-        self.total_score = total_score
-        self.save()
+        from uniworld import grading  # Import here to avoid circular import
+
+        grading.grade_submissions(self.assignment_id, AssignmentSubmission.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['total_score'])
 
     def __str__(self):
         return f"Submission by {self.student.username} for {self.assignment.material.title}"
 
+class SubmissionReceipt(models.Model):
+    """A submission accepted in queued mode, expanded into responses by uniworld.submissions."""
+
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='receipts')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='submission_receipts')
+    answers = models.JSONField(default=dict)
+    received_at = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending', db_index=True)
+    submission = models.OneToOneField(
+        AssignmentSubmission, on_delete=models.SET_NULL, null=True, blank=True, related_name='receipt'
+    )
+    error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Receipt {self.pk} for {self.assignment_id}"
+
 class QuestionResponse(RulesModel):
     class Meta:
         rules_permissions = {
@@ -217,12 +497,28 @@ class QuestionResponse(RulesModel):
             'change': is_course_author_response, # Update score
             'delete': always_deny,
         }
+        indexes = [
+            # Ungraded rows only, for claiming from the grading queue
+            models.Index(
+                fields=['claim_expires_at'],
+                condition=models.Q(score__isnull=True),
+                name='uniworld_resp_ungraded_idx',
+            ),
+            models.Index(fields=['graded_by', 'graded_at'], name='uniworld_resp_grader_idx'),
+        ]
 
     submission = models.ForeignKey(AssignmentSubmission, on_delete=models.CASCADE, related_name='responses')
     question = models.ForeignKey(AssignmentQuestion, on_delete=models.CASCADE)
     response_text = models.TextField(blank=True, null=True)
     selected_option = models.ForeignKey(MCQOption, on_delete=models.SET_NULL, null=True, blank=True)
     score = models.FloatField(null=True, blank=True)
+    # Lease held by a grader working through uniworld.grading_queue; free once it expires
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', editable=False)
+    claim_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    graded_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='graded_responses', editable=False
+    )
+    graded_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Response to question {self.question.id} in {self.submission}"
@@ -0,0 +1,105 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Course, PendingNotification
+from users.models import Profile
+
+BUFFER_BATCH_SIZE = 1000
+# Recipients, and sent events, handled per query; keeps IN lists under SQLite's bound-variable limit
+DIGEST_BATCH_SIZE = 500
+
+# How long the oldest event for a (recipient, course) pair waits before its
+# digest is sent. Immediate users get whatever has built up since the last
+# run of send_notification_digests, so rapid edits still collapse together.
+DIGEST_WINDOWS = {
+    'immediate': timedelta(0),
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+}
+# Used for recipients without a profile, whose events would otherwise never come due
+DEFAULT_FREQUENCY = Profile._meta.get_field('notification_frequency').default
+
+
+def buffer_course_event(course_id, key, message):
+    """Record an event for every student enrolled in the course, replacing any pending event with the same key."""
+    recipients = Course.students.through.objects.filter(course_id=course_id).values_list(
+        'user_id', flat=True
+    ).iterator(chunk_size=BUFFER_BATCH_SIZE)
+
+    buffered = 0
+    while batch := list(islice(recipients, BUFFER_BATCH_SIZE)):
+        PendingNotification.objects.bulk_create(
+            [PendingNotification(recipient_id=user_id, course_id=course_id, key=key, message=message) for user_id in batch],
+            update_conflicts=True,
+            unique_fields=['recipient', 'course', 'key'],
+            update_fields=['message', 'updated_at'],
+        )
+        buffered += len(batch)
+    return buffered
+
+
+def _due_pairs(now):
+    """(recipient, course) pairs whose oldest pending event has waited out the recipient's window."""
+    due = Q(recipient__profile__isnull=True, oldest__lte=now - DIGEST_WINDOWS[DEFAULT_FREQUENCY])
+    for frequency, window in DIGEST_WINDOWS.items():
+        due |= Q(recipient__profile__notification_frequency=frequency, oldest__lte=now - window)
+
+    pairs = PendingNotification.objects.values(
+        'recipient_id', 'course_id', 'recipient__profile__notification_frequency'
+    ).annotate(oldest=Min('created_at')).filter(due)
+    return {(pair['recipient_id'], pair['course_id']) for pair in pairs}
+
+
+def _render(course_name, events):
+    # An update to something added in the same digest adds nothing to the "added" line
+    added = {key.rsplit(':', 1)[0] for key, _ in events if key.endswith(':added')}
+    lines = [
+        f'- {message}' for key, message in events
+        if not (key.endswith(':updated') and key.rsplit(':', 1)[0] in added)
+    ]
+    return f'Updates in "{course_name}"', f'Recent activity in the course "{course_name}":\n\n' + '\n'.join(lines)
+
+
+def collect_digests(send, now=None):
+    """
+    Hand one (subject, message, email) digest per due (recipient, course) pair
+    to send(), a batch of recipients at a time, and remove the events they
+    were made from. Returns the number of digests sent.
+
+    Each batch's events are claimed with select_for_update(skip_locked=True),
+    so overlapping runs never build the same digest, and are only deleted
+    once send() has returned; if it fails they stay for the next run.
+    """
+    now = now or timezone.now()
+    pairs = _due_pairs(now)
+    recipients = sorted({recipient_id for recipient_id, _ in pairs})
+
+    count = 0
+    for start in range(0, len(recipients), DIGEST_BATCH_SIZE):
+        with transaction.atomic():
+            events = PendingNotification.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                recipient_id__in=recipients[start:start + DIGEST_BATCH_SIZE],
+                updated_at__lte=now,
+            ).order_by('recipient_id', 'course_id', 'created_at').values_list(
+                'pk', 'recipient_id', 'course_id', 'recipient__email', 'course__name', 'key', 'message'
+            )
+
+            grouped, sent = {}, []
+            for pk, recipient_id, course_id, email, course_name, key, message in events:
+                if (recipient_id, course_id) not in pairs:
+                    continue
+                sent.append(pk)
+                if email:
+                    grouped.setdefault((recipient_id, course_id), (email, course_name, []))[2].append((key, message))
+
+            digests = [(*_render(course_name, course_events), email) for email, course_name, course_events in grouped.values()]
+            send(digests)
+            # The rows are locked, so nothing re-buffered them since they were read
+            for offset in range(0, len(sent), DIGEST_BATCH_SIZE):
+                PendingNotification.objects.filter(pk__in=sent[offset:offset + DIGEST_BATCH_SIZE]).delete()
+        count += len(digests)
+    return count
@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EnrollmentEvent
+
+DISPATCH_BATCH_SIZE = 500
+
+FROM_TEACHER = {
+    'enrolled': ('New Enrollment in Your Course', 'has enrolled in', 'have enrolled in'),
+    'removed': ('Student Left Your Course', 'has left', 'have left'),
+}
+
+
+def record(course_student_pairs, action, initiated_by=None):
+    """Write one event per (course_id, student_id); call inside the transaction making the change."""
+    EnrollmentEvent.objects.bulk_create([
+        EnrollmentEvent(course_id=course_id, student_id=student_id, action=action, initiated_by=initiated_by)
+        for course_id, student_id in course_student_pairs
+    ])
+
+
+def _name(user):
+    return f'{user.first_name} {user.last_name}'
+
+
+def _left(event):
+    return event.action == 'removed' and event.initiated_by_id == event.student_id
+
+
+def _render(events):
+    """
+    Turn a batch of events into (subject, message, recipient) tuples: one per
+    teacher and action per course for enrolments and students leaving, and
+    one per student and course for students removed or blocked by someone
+    else. Teachers aren't told about enrolments they made themselves.
+    """
+    messages = []
+    grouped = {}
+    # Blocking an enrolled student records a removal and a block; they get one notice for both
+    removed = {}
+    for event in events:
+        if event.action == 'blocked' or (event.action == 'removed' and not _left(event)):
+            if event.student.email:
+                removed.setdefault((event.course_id, event.student_id), event)
+        elif event.action == 'enrolled' and event.initiated_by_id == event.course.teacher_id:
+            continue
+        else:
+            grouped.setdefault((event.course_id, event.action), []).append(event)
+
+    for event in removed.values():
+        # Removals without a recorded initiator were made on the teacher's behalf
+        remover = event.initiated_by or event.course.teacher
+        messages.append((
+            'You Have Been Removed from a Course',
+            f'You have been removed from the course "{event.course.name}" by {_name(remover)}.',
+            event.student.email,
+        ))
+
+    for (_, action), course_events in grouped.items():
+        course = course_events[0].course
+        if not course.teacher.email:
+            continue
+        subject, singular, plural = FROM_TEACHER[action]
+        if len(course_events) == 1:
+            message = f'{_name(course_events[0].student)} {singular} your course "{course.name}".'
+        else:
+            names = '\n'.join(f'- {_name(event.student)}' for event in course_events)
+            message = f'{len(course_events)} students {plural} your course "{course.name}":\n\n{names}'
+        messages.append((subject, message, course.teacher.email))
+    return messages
+
+
+def drain(send, batch_size=DISPATCH_BATCH_SIZE):
+    """
+    Claim and send one batch of undispatched events, returning how many were claimed.
+
+    The events stay locked while send() hands their messages to the broker,
+    and are only marked dispatched once it returns. Concurrent dispatchers
+    skip locked rows, so they never send an event twice, and if send() fails
+    the transaction rolls back and the events are retried by the next run.
+    """
+    with transaction.atomic():
+        events = list(
+            EnrollmentEvent.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(dispatched_at__isnull=True)
+            .select_related('course__teacher', 'student', 'initiated_by')
+            .order_by('pk')[:batch_size]
+        )
+        if not events:
+            return 0
+        send(_render(events))
+        EnrollmentEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_at=timezone.now())
+    return len(events)
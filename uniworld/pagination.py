@@ -0,0 +1,118 @@
+import base64
+import datetime
+import json
+import uuid
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+class _CursorEncoder(json.JSONEncoder):
+    # Unlike DjangoJSONEncoder, keeps microseconds so a seek never skips rows
+    def default(self, o):
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (Decimal, uuid.UUID)):
+            return str(o)
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a unique ordering, e.g. ('last_name', 'first_name', 'id')
+    or ('-submitted_at', '-id').
+
+    Pages are fetched by seeking past the last row seen instead of using OFFSET,
+    so deep pages cost the same as the first one.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+        self.per_page = per_page
+
+    def encode_cursor(self, obj, backwards=False):
+        values = [getattr(obj, field) for field in self.fields]
+        payload = json.dumps({'v': values, 'b': backwards}, separators=(',', ':'), cls=_CursorEncoder)
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, backwards = payload['v'], bool(payload['b'])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        return values, backwards
+
+    def _seek(self, values, backwards):
+        # Expands (a, b, c) > (x, y, z) into a filter the database can serve from a composite index
+        condition = Q()
+        for i, (field, ordering) in enumerate(zip(self.fields, self.ordering)):
+            descending = ordering.startswith('-')
+            lookup = 'lt' if backwards != descending else 'gt'
+            equal = {f: v for f, v in zip(self.fields[:i], values[:i])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[i]})
+        return condition
+
+    def _reversed(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def get_page(self, cursor=None):
+        """Return the page after (or before) the cursor; an invalid or missing cursor gives the first page."""
+        values, backwards = None, False
+        if cursor:
+            try:
+                values, backwards = self.decode_cursor(cursor)
+            except ValueError:
+                pass
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+        ordering = self._reversed() if backwards else list(self.ordering)
+
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            if not has_more:
+                # Walked back to the start, so serve a full first page
+                return self.get_page()
+            rows.reverse()
+            has_next, has_previous = True, True
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_next and rows else None,
+            previous_cursor=self.encode_cursor(rows[0], backwards=True) if has_previous and rows else None,
+        )
@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .blobs import BLOB_DIR
+
+PREVIEW_DIR = 'previews'
+# Longest side, in pixels, of each derivative
+VARIANTS = {
+    'preview': 1024,
+    'thumb': 256,
+}
+JPEG_QUALITY = 82
+# Rendering a hostile or broken PDF must not hold a worker forever
+RENDER_TIMEOUT = 60
+
+
+def digest(name):
+    """The content hash of a stored document, or None for files kept from before content addressing."""
+    if not name or not name.startswith(f'{BLOB_DIR}/'):
+        return None
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def supported(mime_type):
+    return bool(mime_type) and (mime_type.startswith('image/') or mime_type == 'application/pdf')
+
+
+def variant_name(content_digest, variant, mime_type):
+    # PDF pages are rendered to PNG to keep text sharp, photos are re-encoded as JPEG
+    extension = '.png' if mime_type == 'application/pdf' else '.jpg'
+    return f'{PREVIEW_DIR}/{content_digest[:2]}/{content_digest[2:4]}/{content_digest}-{variant}{extension}'
+
+
+def names(document_name, mime_type):
+    content_digest = digest(document_name)
+    if content_digest is None or not supported(mime_type):
+        return {}
+    return {variant: variant_name(content_digest, variant, mime_type) for variant in VARIANTS}
+
+
+def source_prefix(name):
+    """The stored-name prefix of the document a derivative was made from."""
+    content_digest = os.path.basename(name).rsplit('-', 1)[0]
+    return f'{BLOB_DIR}/{content_digest[:2]}/{content_digest[2:4]}/{content_digest}'
+
+
+def urls(lecture):
+    """Derivative URLs for the lecture's document, or None until they have been generated."""
+    variants = names(lecture.document.name, lecture.document_mime_type)
+    if not variants or not all(default_storage.exists(name) for name in variants.values()):
+        return None
+    return {variant: default_storage.url(name) for variant, name in variants.items()}
+
+
+def _save(image, name, format):
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and moved into place, so readers never see half a file
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.render-', delete=False) as temp:
+        try:
+            if format == 'JPEG':
+                image.save(temp, format, quality=JPEG_QUALITY, optimize=True, progressive=True)
+            else:
+                image.save(temp, format, optimize=True)
+        except BaseException:
+            os.unlink(temp.name)
+            raise
+    os.replace(temp.name, path)
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _render_pdf(path, size, output_dir):
+    """The first page of a PDF as a PNG path, using poppler's pdftoppm, or None if it isn't installed."""
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        return None
+    prefix = os.path.join(output_dir, 'page')
+    subprocess.run(
+        [pdftoppm, '-png', '-f', '1', '-l', '1', '-singlefile', '-scale-to', str(size), path, prefix],
+        check=True, timeout=RENDER_TIMEOUT, capture_output=True,
+    )
+    return f'{prefix}.png'
+
+
+def generate(document_name, mime_type, storage):
+    """
+    Write any missing derivatives of a stored document. Derivatives are named
+    after the document's content hash, so a document shared by many lectures,
+    or uploaded again, is only ever rendered once. Returns the number written.
+    """
+    variants = names(document_name, mime_type)
+    missing = {variant: name for variant, name in variants.items() if not default_storage.exists(name)}
+    if not missing:
+        return 0
+
+    largest = max(VARIANTS[variant] for variant in missing)
+    with tempfile.TemporaryDirectory() as work:
+        if mime_type == 'application/pdf':
+            source = _render_pdf(storage.path(document_name), largest, work)
+            if source is None:
+                return 0
+            format = 'PNG'
+        else:
+            source = storage.path(document_name)
+            format = 'JPEG'
+
+        with Image.open(source) as image:
+            # Lets the JPEG decoder scale down while decoding instead of loading every pixel
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            for variant in sorted(missing, key=VARIANTS.get, reverse=True):
+                size = VARIANTS[variant]
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                _save(image if format == 'PNG' else _flatten(image), missing[variant], format)
+    return len(missing)
@@ -0,0 +1,42 @@
+import time
+
+from django.core.cache import cache
+
+from .models import Course
+from .pagination import KeysetPaginator
+
+ROSTER_ORDERING = ('last_name', 'first_name', 'id')
+ROSTER_PAGE_SIZE = 10
+
+TOTAL_CACHE_KEY = 'uniworld:roster_total:{}:{}'
+TOTAL_REFRESH_KEY = 'uniworld:roster_total_refresh:{}:{}'
+TOTAL_MAX_AGE = 5 * 60
+
+
+def roster_paginator(queryset):
+    return KeysetPaginator(queryset, ROSTER_ORDERING, ROSTER_PAGE_SIZE)
+
+
+def count_roster(course_id, relation):
+    """Count a roster ('students' or 'blocked_students') and cache the result."""
+    count = getattr(Course, relation).through.objects.filter(course_id=course_id).count()
+    cache.set(TOTAL_CACHE_KEY.format(course_id, relation), (count, time.time()), None)
+    cache.delete(TOTAL_REFRESH_KEY.format(course_id, relation))
+    return count
+
+
+def roster_total(course_id, relation):
+    """
+    Return the cached size of a roster, or None if it has never been counted.
+
+    Entries older than TOTAL_MAX_AGE are still served, but a background
+    recount is scheduled so the page never waits on a COUNT(*).
+    """
+    from .tasks import refresh_roster_total  # Import here to avoid circular import
+
+    cached = cache.get(TOTAL_CACHE_KEY.format(course_id, relation))
+    if cached is None or time.time() - cached[1] > TOTAL_MAX_AGE:
+        if cache.add(TOTAL_REFRESH_KEY.format(course_id, relation), True, TOTAL_MAX_AGE):
+            refresh_roster_total.delay(course_id, relation)
+            cached = cache.get(TOTAL_CACHE_KEY.format(course_id, relation))
+    return cached[0] if cached is not None else None
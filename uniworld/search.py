@@ -0,0 +1,135 @@
+import hashlib
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+from .models import Course, SearchEntry
+
+SEARCH_RESULT_LIMIT = 10
+SEARCH_CACHE_KEY = 'uniworld:search:{}'
+SEARCH_CACHE_TIMEOUT = 30
+SEARCHABLE_GROUPS = ('teachers', 'students')
+FTS_TABLE = 'uniworld_searchentry_fts'
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class SearchBackend:
+    """Finds SearchEntry rows whose words start with every query term, best match first."""
+
+    def search(self, terms, limit):
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(SearchBackend):
+    def search(self, terms, limit):
+        queryset = SearchEntry.objects.all()
+        for term in terms:
+            queryset = queryset.filter(Q(search_text__startswith=term) | Q(search_text__contains=f' {term}'))
+        return list(queryset.order_by('label')[:limit])
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """Queries the FTS5 table that mirrors uniworld_searchentry, ranked by bm25."""
+
+    def search(self, terms, limit):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return list(SearchEntry.objects.raw(
+            f'SELECT e.* FROM {FTS_TABLE} f JOIN uniworld_searchentry e ON e.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s ORDER BY f.rank LIMIT %s',
+            [match, limit],
+        ))
+
+
+class PostgresTrigramSearchBackend(SearchBackend):
+    """Uses the pg_trgm GIN index on search_text, ranked by word similarity."""
+
+    def search(self, terms, limit):
+        from django.contrib.postgres.search import TrigramWordSimilarity  # Requires psycopg
+
+        query = ' '.join(terms)
+        queryset = SearchEntry.objects.annotate(similarity=TrigramWordSimilarity(query, 'search_text'))
+        for term in terms:
+            queryset = queryset.filter(Q(search_text__startswith=term) | Q(search_text__contains=f' {term}'))
+        return list(queryset.order_by('-similarity', 'label')[:limit])
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgresql': PostgresTrigramSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, DatabaseSearchBackend)()
+
+
+def search(query, limit=SEARCH_RESULT_LIMIT):
+    """Return up to limit {'label', 'url'} dicts for a typeahead query."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+
+    key = SEARCH_CACHE_KEY.format(hashlib.md5(f"{limit}:{' '.join(terms)}".encode()).hexdigest())
+    results = cache.get(key)
+    if results is None:
+        results = [{'label': entry.label, 'url': entry.get_absolute_url()} for entry in get_backend().search(terms, limit)]
+        cache.set(key, results, SEARCH_CACHE_TIMEOUT)
+    return results
+
+
+def course_entry(course):
+    return SearchEntry(
+        kind='course',
+        object_id=course.pk,
+        label=course.name,
+        search_text=' '.join(tokenize(course.name)),
+    )
+
+
+def user_entry(user):
+    return SearchEntry(
+        kind='user',
+        object_id=user.pk,
+        label=f"{user.first_name} {user.last_name} ({user.email})",
+        search_text=' '.join(tokenize(f"{user.first_name} {user.last_name} {user.email}")),
+    )
+
+
+def _save(entry):
+    SearchEntry.objects.update_or_create(
+        kind=entry.kind,
+        object_id=entry.object_id,
+        defaults={'label': entry.label, 'search_text': entry.search_text},
+    )
+
+
+def index_course(course):
+    _save(course_entry(course))
+
+
+def index_user(user):
+    if user.groups.filter(name__in=SEARCHABLE_GROUPS).exists():
+        _save(user_entry(user))
+    else:
+        remove('user', user.pk)
+
+
+def remove(kind, object_id):
+    SearchEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild():
+    """Rebuild the whole index from the Course and User tables."""
+    users = get_user_model().objects.filter(groups__name__in=SEARCHABLE_GROUPS).distinct()
+    entries = [course_entry(course) for course in Course.objects.iterator()]
+    entries += [user_entry(user) for user in users.iterator()]
+
+    SearchEntry.objects.all().delete()
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
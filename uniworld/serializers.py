@@ -36,6 +36,27 @@ class AssignmentSubmissionSerializer(serializers.ModelSerializer):
         model = AssignmentSubmission
         fields = ['id', 'assignment', 'student', 'submitted_at', 'total_score']
 
+class ResponseScoreSerializer(serializers.Serializer):
+    response = serializers.IntegerField()
+    score = serializers.FloatField(min_value=0)
+
+class SubmissionFeedbackSerializer(serializers.Serializer):
+    submission = serializers.IntegerField()
+    feedback = serializers.CharField(allow_blank=True)
+
+class MaterialOrderSerializer(serializers.Serializer):
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.select_related('teacher'))
+    order = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class GradeBatchSerializer(serializers.Serializer):
+    grades = ResponseScoreSerializer(many=True, required=False)
+    feedback = SubmissionFeedbackSerializer(many=True, required=False)
+
+    def validate(self, data):
+        if not data.get('grades') and not data.get('feedback'):
+            raise serializers.ValidationError("Provide at least one grade or feedback entry.")
+        return data
+
 class QuestionResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuestionResponse
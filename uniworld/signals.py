@@ -1,36 +1,265 @@
-from django.db.models.signals import post_save, pre_save
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import AssignmentSubmission, Course, CourseMaterial
+from django.utils import timezone
+from . import autocomplete, blobs, deadlines, grading, media, membership, outbox, previews, search
+from .models import (
+    Assignment, AssignmentQuestion, AssignmentSubmission, Course, CourseMaterial, CourseStats, Feedback, Lecture,
+    MCQOption, SearchEntry
+)
 from .tasks import (
+    buffer_material_notification,
+    generate_document_previews,
     notify_student_of_graded_submission,
-    notify_teacher_of_enrollment,
-    notify_students_of_new_material,
-    notify_students_of_updated_material
 )
 from chat.models import Room
 
+User = get_user_model()
+
 @receiver(post_save, sender=AssignmentSubmission)
 def submission_graded(sender, instance, created, **kwargs):
+    # Grading through uniworld.grading.apply_grades uses bulk_update and notifies on its own
     if not created and instance.total_score is not None:
-        notify_student_of_graded_submission.delay(instance.id)
-
-@receiver(post_save, sender=Course)
-def student_enrolled(sender, instance, created, **kwargs):
-    if not created:
-        # Check if a new student was added
-        if instance.students.exists():
-            latest_student = instance.students.latest('date_joined')
-            notify_teacher_of_enrollment.delay(instance.id, latest_student.id)
+        transaction.on_commit(lambda: notify_student_of_graded_submission.delay(instance.id))
 
 @receiver(post_save, sender=CourseMaterial)
 def material_added_or_updated(sender, instance, created, **kwargs):
-    if created:
-        notify_students_of_new_material.delay(instance.course.id, instance.id)
-    else:
-        notify_students_of_updated_material.delay(instance.course.id, instance.id)
+    # Buffered per student and sent as a digest by send_notification_digests
+    transaction.on_commit(lambda: buffer_material_notification.delay(instance.course_id, instance.id, created))
 
 @receiver(pre_save, sender=Course)
 def create_course_chat_room(sender, instance, **kwargs):
     if not instance.pk and instance.chat_room is None:
         room = Room.objects.create(name=f"Chat for {instance.name}", creator=instance.teacher)
         instance.chat_room = room
+
+@receiver(post_save, sender=Course)
+def create_course_stats(sender, instance, created, **kwargs):
+    if created:
+        CourseStats.objects.get_or_create(course=instance, defaults={'last_activity': instance.created_at})
+
+@receiver(post_save, sender=Feedback)
+def feedback_saved(sender, instance, created, **kwargs):
+    rating = int(instance.rating)
+    stats = CourseStats.objects.filter(course_id=instance.course_id)
+    if created:
+        stats.update(
+            rating_sum=F('rating_sum') + rating,
+            rating_count=F('rating_count') + 1,
+            feedback_count=F('feedback_count') + 1,
+            last_activity=timezone.now(),
+        )
+    else:
+        previous = getattr(instance, '_loaded_rating', None)
+        if previous is None:
+            CourseStats.rebuild(Course.objects.filter(pk=instance.course_id))
+        elif previous != rating:
+            stats.update(rating_sum=F('rating_sum') + (rating - previous), last_activity=timezone.now())
+    instance._loaded_rating = rating
+
+@receiver(post_delete, sender=Feedback)
+def feedback_deleted(sender, instance, **kwargs):
+    CourseStats.objects.filter(course_id=instance.course_id).update(
+        rating_sum=F('rating_sum') - int(instance.rating),
+        rating_count=F('rating_count') - 1,
+        feedback_count=F('feedback_count') - 1,
+    )
+
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # instance is a user and pk_set holds course ids
+        if action == 'pre_clear':
+            instance._cleared_course_ids = list(instance.enrolled_courses.values_list('pk', flat=True))
+            return
+        course_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_course_ids', [])
+        added = 1
+    else:
+        course_ids = [instance.pk]
+        added = len(pk_set or ())
+
+    if action == 'post_add':
+        if added and course_ids:
+            CourseStats.objects.filter(course_id__in=course_ids).update(
+                student_count=F('student_count') + added,
+                last_activity=timezone.now(),
+            )
+    elif action in ('post_remove', 'post_clear') and course_ids:
+        # Removals may name users that were never enrolled, so recount rather than decrement
+        CourseStats.refresh_student_counts(course_ids)
+
+@receiver(m2m_changed, sender=Course.students.through)
+@receiver(m2m_changed, sender=Course.blocked_students.through)
+@receiver(m2m_changed, sender=Course.assistants.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # instance is the user whose courses changed
+        if action.startswith('post_'):
+            membership.invalidate([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_user_ids = list(sender.objects.filter(course_id=instance.pk).values_list('user_id', flat=True))
+    elif action == 'post_clear':
+        membership.invalidate(getattr(instance, '_cleared_user_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        membership.invalidate(pk_set)
+
+def _touched_pairs(sender, instance, reverse, pk_set):
+    """(course_id, user_id) rows currently in the through table that an m2m change names."""
+    rows = sender.objects.filter(**{'user_id' if reverse else 'course_id': instance.pk})
+    if pk_set is not None:
+        rows = rows.filter(**{'course_id__in' if reverse else 'user_id__in': pk_set})
+    return list(rows.values_list('course_id', 'user_id'))
+
+@receiver(m2m_changed, sender=Course.students.through)
+@receiver(m2m_changed, sender=Course.blocked_students.through)
+def record_enrollment_events(sender, instance, action, reverse, pk_set, **kwargs):
+    # Set by views before changing the roster, so the outbox can tell who to notify
+    initiated_by = getattr(instance, '_roster_changed_by', None)
+    if action == 'post_add' and pk_set:
+        # pk_set only holds rows that were actually inserted
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        outbox.record(pairs, 'enrolled' if sender is Course.students.through else 'blocked', initiated_by)
+    elif sender is not Course.students.through:
+        return
+    elif action in ('pre_remove', 'pre_clear'):
+        # Remember who is really enrolled, since remove() accepts users that never were
+        instance._unenrolled_pairs = _touched_pairs(sender, instance, reverse, pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        outbox.record(getattr(instance, '_unenrolled_pairs', []), 'removed', initiated_by)
+
+@receiver(post_save, sender=Course)
+def course_teacher_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_teacher_id', None)
+    if created or previous != instance.teacher_id:
+        membership.invalidate([instance.teacher_id, previous])
+    instance._loaded_teacher_id = instance.teacher_id
+
+@receiver(pre_delete, sender=Course)
+def collect_course_members(sender, instance, **kwargs):
+    instance._member_ids = {instance.teacher_id}
+    instance._member_ids.update(instance.students.values_list('pk', flat=True))
+    instance._member_ids.update(instance.blocked_students.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    membership.invalidate(getattr(instance, '_member_ids', [instance.teacher_id]))
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    # Primary keys can be reused, so never let a new user inherit a stale index
+    if created:
+        membership.invalidate([instance.pk])
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    membership.invalidate([instance.pk])
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    search.index_course(instance)
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    search.remove('course', instance.pk)
+
+def _reindex_user(user, deleted=False):
+    previous = SearchEntry.objects.filter(kind='user', object_id=user.pk).values_list('search_text', flat=True).first()
+    if deleted:
+        search.remove('user', user.pk)
+        autocomplete.invalidate_prefixes(previous)
+    else:
+        search.index_user(user)
+        autocomplete.invalidate_prefixes(previous, search.user_entry(user).search_text)
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which is not searchable
+    if update_fields and not {'first_name', 'last_name', 'email'} & set(update_fields):
+        return
+    _reindex_user(instance)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    _reindex_user(instance, deleted=True)
+
+@receiver(m2m_changed, sender=User.groups.through)
+def index_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a group; a post_clear gives no pk_set, so reindex every current entry
+        users = User.objects.filter(pk__in=pk_set) if pk_set is not None else User.objects.filter(
+            pk__in=SearchEntry.objects.filter(kind='user').values('object_id')
+        )
+        for user in users:
+            _reindex_user(user)
+    else:
+        _reindex_user(instance)
+
+@receiver(m2m_changed, sender=Course.students.through)
+@receiver(m2m_changed, sender=Course.blocked_students.through)
+def roster_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            autocomplete.invalidate_exclusions([instance.pk])
+    elif action == 'pre_clear':
+        instance._roster_course_ids = list(sender.objects.filter(user_id=instance.pk).values_list('course_id', flat=True))
+    elif action == 'post_clear':
+        autocomplete.invalidate_exclusions(getattr(instance, '_roster_course_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        autocomplete.invalidate_exclusions(pk_set)
+
+def _answer_key_changed(assignment_id):
+    if grading.refresh_answer_key(assignment_id):
+        grading.schedule_regrade(assignment_id)
+
+@receiver(post_save, sender=AssignmentQuestion)
+@receiver(post_delete, sender=AssignmentQuestion)
+def question_changed(sender, instance, **kwargs):
+    _answer_key_changed(instance.assignment_id)
+
+@receiver(post_save, sender=MCQOption)
+@receiver(post_delete, sender=MCQOption)
+def option_changed(sender, instance, **kwargs):
+    assignment_id = AssignmentQuestion.objects.filter(pk=instance.question_id).values_list('assignment_id', flat=True).first()
+    if assignment_id is not None:
+        _answer_key_changed(assignment_id)
+
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def assignment_deadline_changed(sender, instance, **kwargs):
+    course_id = CourseMaterial.objects.filter(pk=instance.material_id).values_list('course_id', flat=True).first()
+    if course_id is not None:
+        deadlines.invalidate_course(course_id)
+
+@receiver(post_save, sender=CourseMaterial)
+@receiver(post_delete, sender=CourseMaterial)
+def material_deadline_changed(sender, instance, **kwargs):
+    # Feeds show the material title, and deleting a material deletes its assignment
+    if instance.type == 'assignment':
+        deadlines.invalidate_course(instance.course_id)
+
+@receiver(post_save, sender=Course)
+def course_deadline_changed(sender, instance, created, **kwargs):
+    if not created:
+        deadlines.invalidate_course(instance.pk)
+
+@receiver(post_save, sender=Lecture)
+def lecture_document_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_document', None) or None
+    current = instance.document.name or None
+    if previous != current:
+        blobs.retain(current)
+        blobs.release(previous)
+        if previews.names(current, instance.document_mime_type):
+            mime_type = instance.document_mime_type
+            transaction.on_commit(lambda: generate_document_previews.delay(current, mime_type))
+    media.forget([previous, current])
+    instance._loaded_document = current
+
+@receiver(post_delete, sender=Lecture)
+def lecture_document_deleted(sender, instance, **kwargs):
+    blobs.release(instance.document.name)
+    media.forget([instance.document.name])
@@ -0,0 +1,212 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import grading
+from .models import Assignment, AssignmentQuestion, AssignmentSubmission, MCQOption, QuestionResponse, SubmissionReceipt
+
+FIELD_PREFIX = 'question_'
+QUEUE_BATCH_SIZE = 200
+QUEUE_LOCK_KEY = 'uniworld:submission_queue'
+# Seconds a worker waits before draining, so one run picks up a burst of receipts
+QUEUE_DELAY = 2
+LIST_ORDERING = ('-submitted_at', '-id')
+LIST_PAGE_SIZE = 25
+STATUS_FILTERS = {
+    'graded': Q(total_score__isnull=False),
+    'pending': Q(total_score__isnull=True),
+}
+
+
+def parse_answers(data):
+    """Map question id -> raw answer from form fields named question_<id>."""
+    answers = {}
+    for field, value in data.items():
+        if field.startswith(FIELD_PREFIX) and field[len(FIELD_PREFIX):].isdigit():
+            answers[int(field[len(FIELD_PREFIX):])] = value
+    return answers
+
+
+def load_schema(assignment_id):
+    """The assignment's (question id, type) pairs and an option id -> question id map, in two queries."""
+    questions = list(AssignmentQuestion.objects.filter(assignment_id=assignment_id).order_by('pk').values_list(
+        'pk', 'question_type'
+    ))
+    option_questions = dict(
+        MCQOption.objects.filter(question__assignment_id=assignment_id).values_list('pk', 'question_id')
+    )
+    return questions, option_questions
+
+
+def check_answers(schema, answers):
+    """Validate a whole payload in memory. Returns ([(question id, option id, text)], [errors])."""
+    questions, option_questions = schema
+    cleaned, errors = [], []
+    for number, (question_id, question_type) in enumerate(questions, start=1):
+        answer = answers.get(question_id)
+        if question_type == 'MCQ':
+            try:
+                option_id = int(answer)
+            except (TypeError, ValueError):
+                errors.append(f"Please choose an answer for question {number}.")
+                continue
+            if option_questions.get(option_id) != question_id:
+                errors.append(f"The answer to question {number} is not one of its options.")
+                continue
+            cleaned.append((question_id, option_id, None))
+        else:
+            cleaned.append((question_id, None, answer or ''))
+    return cleaned, errors
+
+
+def validate_answers(assignment_id, answers):
+    return check_answers(load_schema(assignment_id), answers)
+
+
+def _build_responses(answer_key, cleaned):
+    """Unsaved responses with MCQ scores, and the submission total if nothing needs manual grading."""
+    responses = [
+        QuestionResponse(
+            question_id=question_id,
+            selected_option_id=option_id,
+            response_text=text,
+            score=answer_key.score(question_id, option_id, None) if option_id is not None else None,
+        )
+        for question_id, option_id, text in cleaned
+    ]
+    auto_graded = bool(responses) and all(response.selected_option_id is not None for response in responses)
+    return responses, sum(response.score for response in responses) if auto_graded else None
+
+
+def create_submission(assignment_id, student, cleaned):
+    """
+    Insert a submission and all of its responses in one transaction, scoring
+    MCQ responses from the answer key. A submission with only MCQ questions is
+    fully graded on arrival.
+    """
+    responses, total_score = _build_responses(grading.get_answer_key(assignment_id), cleaned)
+
+    with transaction.atomic():
+        submission = AssignmentSubmission.objects.create(
+            assignment_id=assignment_id,
+            student=student,
+            total_score=total_score,
+        )
+        for response in responses:
+            response.submission = submission
+        QuestionResponse.objects.bulk_create(responses)
+    return submission
+
+
+def is_queued(assignment, now=None):
+    """Whether submissions should be queued because the assignment's deadline is close."""
+    window = getattr(settings, 'SUBMISSION_QUEUE_WINDOW', None)
+    if window is None:
+        return False
+    now = now or timezone.now()
+    return abs(now - assignment.due_date) <= timedelta(minutes=window)
+
+
+def queue_submission(assignment_id, student, answers):
+    """Record the raw answers in one insert and make sure a worker will expand them."""
+    from .tasks import process_submission_receipts  # Import here to avoid circular import
+
+    receipt = SubmissionReceipt.objects.create(
+        assignment_id=assignment_id,
+        student=student,
+        answers={str(question_id): answer for question_id, answer in answers.items()},
+    )
+    if cache.add(QUEUE_LOCK_KEY, True, QUEUE_DELAY * 10):
+        transaction.on_commit(lambda: process_submission_receipts.apply_async(countdown=QUEUE_DELAY))
+    return receipt
+
+
+def process_receipts(batch_size=QUEUE_BATCH_SIZE):
+    """
+    Expand one batch of pending receipts into submissions, inserting all of
+    their responses with a single bulk_create. Returns how many were claimed.
+    """
+    with transaction.atomic():
+        receipts = list(
+            SubmissionReceipt.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('received_at')[:batch_size]
+        )
+        if not receipts:
+            return 0
+
+        schemas, answer_keys, responses = {}, {}, []
+        now = timezone.now()
+        for receipt in receipts:
+            if receipt.assignment_id not in schemas:
+                schemas[receipt.assignment_id] = load_schema(receipt.assignment_id)
+                answer_keys[receipt.assignment_id] = grading.get_answer_key(receipt.assignment_id)
+
+            answers = {int(question_id): answer for question_id, answer in receipt.answers.items()}
+            cleaned, errors = check_answers(schemas[receipt.assignment_id], answers)
+            receipt.processed_at = now
+            if errors:
+                # The questions changed after the receipt was issued
+                receipt.status, receipt.error = 'failed', '\n'.join(errors)
+                continue
+
+            receipt_responses, total_score = _build_responses(answer_keys[receipt.assignment_id], cleaned)
+            receipt.submission = AssignmentSubmission.objects.create(
+                assignment_id=receipt.assignment_id,
+                student_id=receipt.student_id,
+                submitted_at=receipt.received_at,
+                total_score=total_score,
+            )
+            for response in receipt_responses:
+                response.submission = receipt.submission
+            responses += receipt_responses
+            receipt.status = 'processed'
+
+        QuestionResponse.objects.bulk_create(responses, batch_size=QUEUE_BATCH_SIZE)
+        SubmissionReceipt.objects.bulk_update(receipts, ['status', 'submission', 'error', 'processed_at'])
+    return len(receipts)
+
+
+def assignment_summaries(course):
+    """The course's assignments with their pending submission counts, in one grouped query."""
+    return list(
+        Assignment.objects.filter(material__course=course)
+        .select_related('material')
+        .annotate(pending=Count('submissions', filter=Q(submissions__total_score__isnull=True)))
+        .order_by('material__sequence', 'pk')
+    )
+
+
+def _int_param(params, name):
+    try:
+        return int(params.get(name, ''))
+    except ValueError:
+        return None
+
+
+def filter_submissions(assignments, params):
+    """
+    Submissions to the given assignments narrowed by the status, assignment and
+    student query parameters. Returns (queryset, the filters that were applied).
+    """
+    filters = {
+        'status': params.get('status') if params.get('status') in STATUS_FILTERS else None,
+        'assignment': _int_param(params, 'assignment'),
+        'student': _int_param(params, 'student'),
+    }
+    assignment_ids = [assignment.pk for assignment in assignments]
+    if filters['assignment'] not in assignment_ids:
+        filters['assignment'] = None
+
+    queryset = AssignmentSubmission.objects.filter(
+        assignment__in=[filters['assignment']] if filters['assignment'] else assignment_ids
+    ).select_related('student', 'assignment__material')
+    if filters['status']:
+        queryset = queryset.filter(STATUS_FILTERS[filters['status']])
+    if filters['student']:
+        queryset = queryset.filter(student=filters['student'])
+    return queryset, {name: value for name, value in filters.items() if value is not None}
@@ -1,48 +1,21 @@
+from itertools import islice
+from smtplib import SMTPException, SMTPRecipientsRefused
+from subprocess import SubprocessError
+
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.contrib.auth import get_user_model
-from .models import Course, CourseMaterial, AssignmentSubmission
+from .models import Course, CourseMaterial, AssignmentSubmission, EnrollmentImport, Lecture
+from .grading import regrade_assignment
+from .notifications import buffer_course_event, collect_digests
+from .outbox import DISPATCH_BATCH_SIZE, drain
+from .previews import generate as generate_previews
+from .rosters import count_roster
+from .submissions import QUEUE_BATCH_SIZE, QUEUE_LOCK_KEY, process_receipts
 from django.conf import settings
+from django.core.cache import cache
 
-@shared_task
-def notify_teacher_of_enrollment(course_id, student_id):
-    User = get_user_model()
-    try:
-        course = Course.objects.get(id=course_id)
-        student = User.objects.get(id=student_id)
-        teacher = course.teacher
-
-        send_mail(
-            subject='New Enrollment in Your Course',
-            message=f'{student.first_name} {student.last_name} has enrolled in your course "{course.name}".',
-            from_email='no-reply@uniworld.example',
-            recipient_list=[teacher.email],
-            fail_silently=False,
-        )
-    except Course.DoesNotExist:
-        print(f"Course with id {course_id} does not exist.")
-    except User.DoesNotExist:
-        print(f"User with id {student_id} does not exist.")
-
-@shared_task
-def notify_teacher_of_unenrollment(course_id, student_id):
-    User = get_user_model()
-    try:
-        course = Course.objects.get(id=course_id)
-        student = User.objects.get(id=student_id)
-        teacher = course.teacher
-
-        send_mail(
-            subject='Student Left Your Course',
-            message=f'{student.first_name} {student.last_name} has left your course "{course.name}".',
-            from_email='no-reply@uniworld.example',
-            recipient_list=[teacher.email],
-            fail_silently=False,
-        )
-    except Course.DoesNotExist:
-        print(f"Course with id {course_id} does not exist.")
-    except User.DoesNotExist:
-        print(f"User with id {student_id} does not exist.")
+EMAIL_CHUNK_SIZE = 100
 
 @shared_task
 def notify_student_of_addition(course_id, student_id):
@@ -65,70 +38,95 @@ def notify_student_of_addition(course_id, student_id):
         print(f"User with id {student_id} does not exist.")
 
 @shared_task
-def notify_student_of_removal(course_id, student_id):
+def notify_students_of_addition(course_id, student_ids):
     User = get_user_model()
     try:
-        course = Course.objects.get(id=course_id)
-        student = User.objects.get(id=student_id)
+        course = Course.objects.select_related('teacher').get(id=course_id)
         teacher = course.teacher
 
-        send_mail(
-            subject='You Have Been Removed from a Course',
-            message=f'You have been removed from the course "{course.name}" by {teacher.first_name} {teacher.last_name}.',
-            from_email='no-reply@uniworld.example',
-            recipient_list=[student.email],
-            fail_silently=False,
+        fan_out_email(
+            'You Have Been Added to a Course',
+            f'You have been added to the course "{course.name}" by {teacher.first_name} {teacher.last_name}.',
+            User.objects.filter(id__in=student_ids).exclude(email='').values_list('email', flat=True),
         )
     except Course.DoesNotExist:
         print(f"Course with id {course_id} does not exist.")
-    except User.DoesNotExist:
-        print(f"User with id {student_id} does not exist.")
 
-@shared_task
-def notify_students_of_new_material(course_id, material_id):
-    User = get_user_model()
+@shared_task(bind=True, max_retries=5)
+def send_email_chunk(self, messages):
+    """
+    Send (subject, message, recipient) messages one at a time over a single
+    connection. Refused recipients are dropped, since retrying won't change
+    the answer; any other failure retries with only the messages not yet
+    sent, so nobody gets the same message twice.
+    """
+    connection = get_connection(fail_silently=False)
+    sent = 0
     try:
-        course = Course.objects.get(id=course_id)
-        material = CourseMaterial.objects.get(id=material_id)
-        students = course.students.all()
-
-        for student in students:
-            send_mail(
-                subject='New Course Material Added',
-                message=f'New material "{material.title}" has been added to the course "{course.name}".',
-                from_email='no-reply@uniworld.example',
-                recipient_list=[student.email],
-                fail_silently=False,
-            )
-    except Course.DoesNotExist:
-        print(f"Course with id {course_id} does not exist.")
-    except CourseMaterial.DoesNotExist:
-        print(f"CourseMaterial with id {material_id} does not exist.")
-    except User.DoesNotExist:
-        print(f"User does not exist.")
+        connection.open()
+        for sent, (subject, message, recipient) in enumerate(messages):
+            try:
+                EmailMessage(subject, message, 'no-reply@uniworld.example', [recipient], connection=connection).send()
+            except SMTPRecipientsRefused:
+                print(f"Recipient {recipient} was refused, not retrying.")
+    except (SMTPException, OSError) as exc:
+        raise self.retry(exc=exc, args=[messages[sent:]], countdown=2 ** self.request.retries)
+    finally:
+        connection.close()
+
+def fan_out_messages(messages):
+    """Queue one send_email_chunk task per EMAIL_CHUNK_SIZE (subject, message, recipient) tuples; returns the number of chunks."""
+    messages = iter(messages)
+    chunks = 0
+    while chunk := list(islice(messages, EMAIL_CHUNK_SIZE)):
+        send_email_chunk.delay(chunk)
+        chunks += 1
+    return chunks
+
+def fan_out_email(subject, message, recipients):
+    return fan_out_messages((subject, message, recipient) for recipient in recipients)
 
 @shared_task
-def notify_students_of_updated_material(course_id, material_id):
-    User = get_user_model()
+def buffer_material_notification(course_id, material_id, created):
     try:
-        course = Course.objects.get(id=course_id)
-        material = CourseMaterial.objects.get(id=material_id)
-        students = course.students.all()
-
-        for student in students:
-            send_mail(
-                subject='Course Material Updated',
-                message=f'The material "{material.title}" in the course "{course.name}" has been updated.',
-                from_email='no-reply@uniworld.example',
-                recipient_list=[student.email],
-                fail_silently=False,
-            )
-    except Course.DoesNotExist:
-        print(f"Course with id {course_id} does not exist.")
+        material = CourseMaterial.objects.only('title').get(id=material_id)
     except CourseMaterial.DoesNotExist:
         print(f"CourseMaterial with id {material_id} does not exist.")
-    except User.DoesNotExist:
-        print(f"User does not exist.")
+        return 0
+
+    if created:
+        key, message = f'material:{material_id}:added', f'New material "{material.title}" has been added.'
+    else:
+        key, message = f'material:{material_id}:updated', f'The material "{material.title}" has been updated.'
+    return buffer_course_event(course_id, key, message)
+
+@shared_task
+def send_notification_digests():
+    return collect_digests(fan_out_messages)
+
+@shared_task
+def dispatch_enrollment_events():
+    dispatched = 0
+    while True:
+        claimed = drain(fan_out_messages)
+        dispatched += claimed
+        if claimed < DISPATCH_BATCH_SIZE:
+            return dispatched
+
+@shared_task
+def regrade_assignment_task(assignment_id):
+    return regrade_assignment(assignment_id)
+
+@shared_task
+def process_submission_receipts():
+    # Receipts queued from now on schedule another run
+    cache.delete(QUEUE_LOCK_KEY)
+    processed = 0
+    while True:
+        claimed = process_receipts()
+        processed += claimed
+        if claimed < QUEUE_BATCH_SIZE:
+            return processed
 
 @shared_task
 def notify_teacher_of_assignment_submission(course_id, student_id, assignment_id):
@@ -153,22 +151,17 @@ def notify_teacher_of_assignment_submission(course_id, student_id, assignment_id
     except AssignmentSubmission.DoesNotExist:
         print(f"Assignment with id {assignment_id} does not exist.")
 
-@shared_task
-def notify_student_of_graded_submission(submission_id):
-    from .models import AssignmentSubmission  # Import here to avoid circular import
-    
-    try:
-        submission = AssignmentSubmission.objects.get(id=submission_id)
-        student = submission.student
-        assignment = submission.assignment
+def _graded_message(submission):
+    student = submission.student
+    assignment = submission.assignment
 
-        subject = f'Your submission for "{assignment.material.title}" has been graded'
-        message = f"""
+    subject = f'Your submission for "{assignment.material.title}" has been graded'
+    message = f"""
         Dear {student.first_name},
 
         Your submission for the assignment "{assignment.material.title}" in the course "{assignment.material.course.name}" has been graded.
 
-        Your score: {submission.total_score} / {assignment.total_marks}
+        Your score: {submission.total_score} / {assignment.total_marks()}
 
         Feedback: {submission.feedback or 'No feedback provided.'}
 
@@ -177,14 +170,60 @@ def notify_student_of_graded_submission(submission_id):
         Best regards,
         The UniWorld Team
         """
+    return subject, message, student.email
+
+@shared_task
+def notify_student_of_graded_submission(submission_id):
+    from .models import AssignmentSubmission  # Import here to avoid circular import
+    
+    try:
+        submission = AssignmentSubmission.objects.get(id=submission_id)
+        subject, message, email = _graded_message(submission)
 
         send_mail(
             subject=subject,
             message=message,
             from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[student.email],
+            recipient_list=[email],
             fail_silently=False,
         )
     except AssignmentSubmission.DoesNotExist:
         print(f"Submission with id {submission_id} does not exist.")
 
+@shared_task
+def notify_students_of_grades(submission_ids):
+    """One email per graded submission, rendered from a single query and sent in chunks."""
+    from .models import AssignmentSubmission  # Import here to avoid circular import
+
+    submissions = AssignmentSubmission.objects.filter(
+        pk__in=submission_ids, total_score__isnull=False
+    ).select_related('student', 'assignment__material__course')
+    return fan_out_messages(
+        _graded_message(submission) for submission in submissions.iterator(chunk_size=EMAIL_CHUNK_SIZE)
+        if submission.student.email
+    )
+
+@shared_task
+def refresh_roster_total(course_id, relation):
+    return count_roster(course_id, relation)
+
+@shared_task
+def process_enrollment_import(import_id):
+    from .enrollment import run_import  # Import here to avoid circular import
+
+    try:
+        enrollment_import = EnrollmentImport.objects.select_related('course').get(id=import_id)
+    except EnrollmentImport.DoesNotExist:
+        print(f"EnrollmentImport with id {import_id} does not exist.")
+        return
+    if not enrollment_import.is_finished:
+        run_import(enrollment_import)
+
+@shared_task
+def generate_document_previews(document_name, mime_type):
+    try:
+        return generate_previews(document_name, mime_type, Lecture._meta.get_field('document').storage)
+    except (OSError, SubprocessError) as error:
+        # Unreadable or broken documents keep the in-browser preview; retrying won't fix them
+        print(f"Could not generate previews of {document_name}: {error}")
+        return 0
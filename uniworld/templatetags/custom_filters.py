@@ -1,4 +1,5 @@
 from django import template
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
 register = template.Library()
@@ -11,4 +12,23 @@ def verbose_name(instance):
 def star_rating(rating, max_rating=5):
     html = ''.join([f'<span class="star unfilled">☆</span>' for _ in range(max_rating - int(rating))] +
                    [f'<span class="star filled">★</span>' for _ in range(int(rating))])
-    return mark_safe(html)
\ No newline at end of file
+    return mark_safe(html)
+
+@register.simple_tag
+def avatar(profile, size, alt='', css_class='', display=None):
+    """
+    A profile picture at one of users.avatars.SIZES, shown display pixels
+    wide (size by default), or the original until it has been processed.
+    """
+    display = display or size
+    urls = profile.avatar_urls(size)
+    if urls is None:
+        return format_html(
+            '<img src="{}" alt="{}" width="{}" height="{}" class="{}" style="object-fit: cover;">',
+            profile.avatar.url, alt, display, display, css_class,
+        )
+    return format_html(
+        '<picture><source srcset="{}" type="image/webp">'
+        '<img src="{}" alt="{}" width="{}" height="{}" class="{}" style="object-fit: cover;"></picture>',
+        urls['webp'], urls['jpeg'], alt, display, display, css_class,
+    )
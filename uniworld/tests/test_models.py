@@ -1,7 +1,19 @@
-from django.test import TestCase
+import os
+import statistics
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from uniworld import analysis, blobs, grading, membership, tasks
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from uniworld.models import Course, CourseMaterial, Assignment, AssignmentQuestion, MCQOption, AssignmentSubmission, QuestionResponse, Feedback
+from uniworld.models import Blob, Course, CourseStats, CourseMaterial, Lecture, Assignment, AssignmentQuestion, MCQOption, AssignmentSubmission, QuestionResponse, Feedback
 
 User = get_user_model()
 
@@ -235,4 +247,377 @@ class FeedbackModelTest(TestCase):
         self.assertFalse(self.teacher.has_perm(Feedback.get_perm('change'), self.feedback))
         self.assertTrue(self.student.has_perm(Feedback.get_perm('change'), self.feedback))
         self.assertFalse(self.teacher.has_perm(Feedback.get_perm('delete'), self.feedback))
-        self.assertTrue(self.student.has_perm(Feedback.get_perm('delete'), self.feedback))
\ No newline at end of file
+        self.assertTrue(self.student.has_perm(Feedback.get_perm('delete'), self.feedback))
+
+class CourseStatsModelTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.student = User.objects.create_user(username='student', password='12345')
+        self.other_student = User.objects.create_user(username='other_student', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+
+    def get_stats(self):
+        return CourseStats.objects.get(course=self.course)
+
+    def test_stats_follow_enrollment(self):
+        self.course.students.add(self.student, self.other_student)
+        self.assertEqual(self.get_stats().student_count, 2)
+
+        self.course.students.remove(self.student, self.student)
+        self.assertEqual(self.get_stats().student_count, 1)
+
+        self.other_student.enrolled_courses.clear()
+        self.assertEqual(self.get_stats().student_count, 0)
+
+        self.student.enrolled_courses.add(self.course)
+        self.assertEqual(self.get_stats().student_count, 1)
+
+    def test_stats_follow_feedback(self):
+        feedback = Feedback.objects.create(course=self.course, user=self.student, rating=4)
+        Feedback.objects.create(course=self.course, user=self.other_student, rating='5')
+        stats = self.get_stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count, stats.feedback_count), (9, 2, 2))
+        self.assertEqual(stats.average_rating, 4.5)
+
+        feedback = Feedback.objects.get(pk=feedback.pk)
+        feedback.rating = 2
+        feedback.save()
+        self.assertEqual(self.get_stats().rating_sum, 7)
+
+        feedback.delete()
+        stats = self.get_stats()
+        self.assertEqual((stats.rating_sum, stats.rating_count, stats.feedback_count), (5, 1, 1))
+
+    def test_rebuild_repairs_stats(self):
+        self.course.students.add(self.student)
+        Feedback.objects.create(course=self.course, user=self.student, rating=3)
+        CourseStats.objects.filter(course=self.course).update(student_count=42, rating_sum=0)
+
+        self.assertEqual(CourseStats.rebuild(), 1)
+        stats = self.get_stats()
+        self.assertEqual((stats.student_count, stats.rating_sum, stats.rating_count), (1, 3, 1))
+        self.assertEqual(Course.objects.get(pk=self.course.pk).average_rating, 3)
+
+class MembershipTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.student = User.objects.create_user(username='student', password='12345')
+        self.courses = [
+            Course.objects.create(name=f'Course {i}', description='Description', teacher=self.teacher)
+            for i in range(3)
+        ]
+        self.courses[0].students.add(self.student)
+        self.courses[2].blocked_students.add(self.student)
+
+    def test_membership_checks(self):
+        self.assertTrue(membership.is_enrolled(self.student, self.courses[0].pk))
+        self.assertFalse(membership.is_enrolled(self.student, self.courses[1].pk))
+        self.assertTrue(membership.is_blocked(self.student, self.courses[2].pk))
+        self.assertFalse(membership.is_enrolled(self.teacher, self.courses[0].pk))
+
+    def test_batch_membership_checks(self):
+        course_ids = [course.pk for course in self.courses]
+        with self.assertNumQueries(1):
+            self.assertEqual(membership.enrolled_course_ids(self.student, course_ids), {self.courses[0].pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(membership.blocked_course_ids(self.student, course_ids), {self.courses[2].pk})
+
+    def test_index_is_invalidated_by_signals(self):
+        self.assertEqual(membership.get_index(self.teacher).taught, {course.pk for course in self.courses})
+        self.assertEqual(membership.get_index(self.student).enrolled, {self.courses[0].pk})
+
+        self.courses[1].students.add(self.student)
+        self.courses[2].blocked_students.remove(self.student)
+        self.assertEqual(membership.get_index(self.student).enrolled, {self.courses[0].pk, self.courses[1].pk})
+        self.assertEqual(membership.get_index(self.student).blocked, set())
+
+        self.student.enrolled_courses.clear()
+        self.assertEqual(membership.get_index(self.student).enrolled, set())
+
+        self.courses[0].teacher = self.student
+        self.courses[0].save()
+        self.assertEqual(membership.get_index(self.student).taught, {self.courses[0].pk})
+        self.assertNotIn(self.courses[0].pk, membership.get_index(self.teacher).taught)
+
+        self.courses[1].delete()
+        self.assertNotIn(self.courses[1].pk, membership.get_index(self.teacher).taught)
+
+    def test_assistant_checks_use_the_index(self):
+        self.courses[1].assistants.add(self.student)
+        membership.get_index(self.student)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.student.has_perm(Course.get_perm('grade_submissions'), self.courses[1]))
+            self.assertFalse(self.student.has_perm(Course.get_perm('grade_submissions'), self.courses[0]))
+
+        self.courses[1].assistants.remove(self.student)
+        self.assertFalse(membership.is_assistant(self.student, self.courses[1].pk))
+
+    def test_request_cache_is_shared_and_invalidated(self):
+        with membership.request_cache():
+            with self.assertNumQueries(1):
+                membership.enrolled_course_ids(self.student, [course.pk for course in self.courses])
+                self.assertTrue(self.student.has_perm(Course.get_perm('leave_course'), self.courses[0]))
+                self.assertFalse(self.student.has_perm(Course.get_perm('leave_course'), self.courses[1]))
+
+            self.courses[1].students.add(self.student)
+            self.assertTrue(self.student.has_perm(Course.get_perm('leave_course'), self.courses[1]))
+
+class GradingTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.material = CourseMaterial.objects.create(course=self.course, title='Quiz', type='assignment', sequence=1)
+        self.assignment = Assignment.objects.create(material=self.material, due_date='2023-12-31 23:59:59 +00:00')
+        self.mcq = AssignmentQuestion.objects.create(assignment=self.assignment, question_text='Q1', question_type='MCQ', marks=5)
+        self.right = MCQOption.objects.create(question=self.mcq, option_text='Right', is_correct=True)
+        self.wrong = MCQOption.objects.create(question=self.mcq, option_text='Wrong', is_correct=False)
+        self.essay = AssignmentQuestion.objects.create(assignment=self.assignment, question_text='Q2', question_type='ESSAY', marks=10)
+
+        self.submissions = []
+        for i in range(6):
+            student = User.objects.create_user(username=f'student{i}', password='12345')
+            submission = AssignmentSubmission.objects.create(assignment=self.assignment, student=student)
+            QuestionResponse.objects.create(submission=submission, question=self.mcq,
+                                            selected_option=self.right if i % 2 else self.wrong)
+            QuestionResponse.objects.create(submission=submission, question=self.essay, response_text='...', score=i)
+            self.submissions.append(submission)
+
+    def totals(self):
+        return list(AssignmentSubmission.objects.order_by('pk').values_list('total_score', flat=True))
+
+    def test_whole_assignment_in_constant_queries(self):
+        grading.get_answer_key(self.assignment.pk)
+        with self.assertNumQueries(6):
+            self.assertEqual(grading.grade_submissions(self.assignment.pk), 6)
+        self.assertEqual(self.totals(), [0, 6, 2, 8, 4, 10])
+
+    def test_answer_key_is_denormalised_and_versioned(self):
+        assignment = Assignment.objects.get(pk=self.assignment.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(assignment.total_marks(), 15)
+            answer_key = grading.get_answer_key(assignment)
+        self.assertEqual(answer_key.correct, {self.mcq.pk: frozenset([self.right.pk])})
+
+        AssignmentQuestion.objects.create(assignment=self.assignment, question_text='Q3', question_type='ESSAY', marks=5)
+        assignment.refresh_from_db()
+        self.assertEqual(assignment.total_marks(), 20)
+        self.assertEqual(grading.get_answer_key(assignment).version, answer_key.version + 1)
+
+    def test_calculate_total_score(self):
+        self.submissions[1].calculate_total_score()
+        self.assertEqual(self.submissions[1].total_score, 6)
+
+    def test_unmarked_essays_leave_the_total_empty(self):
+        QuestionResponse.objects.filter(submission=self.submissions[1], question=self.essay).update(score=None)
+        AssignmentSubmission.objects.filter(pk=self.submissions[1].pk).update(total_score=1)
+        self.submissions[1].calculate_total_score()
+        self.assertIsNone(self.submissions[1].total_score)
+
+        grading.grade_submissions(self.assignment.pk)
+        self.assertEqual(self.totals(), [0, None, 2, 8, 4, 10])
+
+    def test_answer_key_change_regrades_graded_submissions(self):
+        # Let the regrade scheduled while building the quiz run first
+        self.assertEqual(grading.regrade_assignment(self.assignment.pk), 0)
+        grading.grade_submissions(self.assignment.pk, AssignmentSubmission.objects.filter(pk__in=[
+            self.submissions[0].pk, self.submissions[1].pk,
+        ]))
+
+        with mock.patch.object(tasks.regrade_assignment_task, 'apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.wrong.is_correct = True
+            self.wrong.save()
+            self.right.is_correct = False
+            self.right.save()
+        apply_async.assert_called_once()
+
+        self.assertEqual(grading.regrade_assignment(self.assignment.pk), 2)
+        self.assertEqual(self.totals(), [5, 1, None, None, None, None])
+
+    def test_unchanged_answer_key_does_not_regrade(self):
+        grading.get_answer_key(self.assignment.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.right.option_text = 'Still right'
+            self.right.save()
+        self.assertEqual(callbacks, [])
+
+    def test_apply_grades_across_submissions(self):
+        essays = {
+            submission.pk: submission.responses.get(question=self.essay).pk for submission in self.submissions
+        }
+        QuestionResponse.objects.filter(pk=essays[self.submissions[2].pk]).update(score=None)
+
+        with mock.patch.object(tasks.notify_students_of_grades, 'delay') as notify, \
+                mock.patch.object(tasks.notify_student_of_graded_submission, 'delay') as notify_one, \
+                self.captureOnCommitCallbacks(execute=True):
+            graded, rejected = grading.apply_grades(
+                {essays[self.submissions[0].pk]: 7, essays[self.submissions[1].pk]: 9},
+                {self.submissions[1].pk: 'Good', self.submissions[2].pk: 'Still marking'},
+            )
+
+        self.assertEqual(rejected, [])
+        self.assertEqual(graded, [self.submissions[0].pk, self.submissions[1].pk])
+        notify.assert_called_once_with(graded)
+        notify_one.assert_not_called()
+        self.assertEqual(self.totals()[:3], [7, 14, None])
+        self.assertEqual(AssignmentSubmission.objects.get(pk=self.submissions[2].pk).feedback, 'Still marking')
+
+    def test_check_grades(self):
+        essay = self.submissions[0].responses.get(question=self.essay).pk
+        mcq = self.submissions[0].responses.get(question=self.mcq).pk
+        course_ids, errors = grading.check_grades({essay: 11, mcq: 1, 0: 1})
+        self.assertEqual(course_ids, {self.course.pk})
+        self.assertEqual(len(errors), 3)
+
+class ItemAnalysisTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.material = CourseMaterial.objects.create(course=self.course, title='Quiz', type='assignment', sequence=1)
+        self.assignment = Assignment.objects.create(material=self.material, due_date='2023-12-31 23:59:59 +00:00')
+        self.q1 = AssignmentQuestion.objects.create(assignment=self.assignment, question_text='Q1', question_type='MCQ', marks=2)
+        self.a, self.b, self.c = [
+            MCQOption.objects.create(question=self.q1, option_text=text, is_correct=text == 'A') for text in 'ABC'
+        ]
+        self.q2 = AssignmentQuestion.objects.create(assignment=self.assignment, question_text='Q2', question_type='MCQ', marks=3)
+        self.x, self.y = [
+            MCQOption.objects.create(question=self.q2, option_text=text, is_correct=text == 'X') for text in 'XY'
+        ]
+        for answers in [(self.a, self.x), (self.a, self.y), (self.b, self.x), (self.c, self.y), (self.a, self.x)]:
+            self.submit(*answers)
+
+    def submit(self, *options, **fields):
+        student = User.objects.create_user(username=f'student{User.objects.count()}', password='12345')
+        submission = AssignmentSubmission.objects.create(assignment=self.assignment, student=student, **fields)
+        for option in options:
+            QuestionResponse.objects.create(submission=submission, question=option.question, selected_option=option)
+        return submission
+
+    def item(self, result, question):
+        return next(item for item in result['items'] if item['question'] == question)
+
+    def test_statistics(self):
+        result = analysis.analyse(self.assignment)
+        self.assertEqual(result['submissions'], 5)
+
+        q1 = self.item(result, self.q1)
+        self.assertAlmostEqual(q1['p_value'], 0.6)
+        # Right on Q1 against the Q2 score: [1, 1, 0, 0, 1] vs [3, 0, 3, 0, 3]
+        self.assertAlmostEqual(q1['point_biserial'], statistics.correlation([1, 1, 0, 0, 1], [3, 0, 3, 0, 3]))
+        self.assertEqual([(row['option'], row['count']) for row in q1['options']], [(self.a, 3), (self.b, 1), (self.c, 1)])
+        # Totals of 5, 2, 3, 0 and 5 marks out of 5
+        self.assertEqual([bucket['count'] for bucket in result['distribution']], [1, 0, 0, 0, 1, 0, 1, 0, 0, 2])
+
+    def test_new_submissions_are_folded_in(self):
+        analysis.analyse(self.assignment)
+        self.submit(self.b, self.y)
+        with self.assertNumQueries(3):
+            incremental = analysis.analyse(self.assignment)
+        self.assertEqual(incremental['submissions'], 6)
+
+        cache.clear()
+        full = analysis.analyse(self.assignment)
+        for question in (self.q1, self.q2):
+            self.assertAlmostEqual(self.item(incremental, question)['point_biserial'], self.item(full, question)['point_biserial'])
+            self.assertEqual(self.item(incremental, question)['p_value'], self.item(full, question)['p_value'])
+
+    def test_lower_ids_committed_late_are_folded_in(self):
+        last = AssignmentSubmission.objects.order_by('pk').last().pk
+        newer = self.submit(self.a, self.x, pk=last + 2)
+        analysis.analyse(self.assignment)
+        # Inserted just before the newer submission, but committed after the sums were updated
+        late = self.submit(self.c, self.y, pk=last + 1)
+        AssignmentSubmission.objects.filter(pk=late.pk).update(recorded_at=newer.recorded_at - timedelta(seconds=5))
+
+        incremental = analysis.analyse(self.assignment)
+        self.assertEqual(incremental['submissions'], 7)
+        self.assertEqual(analysis.analyse(self.assignment)['submissions'], 7)
+
+        cache.clear()
+        full = analysis.analyse(self.assignment)
+        for question in (self.q1, self.q2):
+            self.assertEqual(self.item(incremental, question)['p_value'], self.item(full, question)['p_value'])
+
+    def test_changed_answer_key_starts_over(self):
+        analysis.analyse(self.assignment)
+        self.b.is_correct = True
+        self.b.save()
+        self.assertAlmostEqual(self.item(analysis.analyse(self.assignment), self.q1)['p_value'], 0.8)
+
+class BlobStorageTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.sequence = 0
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.storage = Lecture._meta.get_field('document').storage
+
+    def lecture(self, name, data):
+        self.sequence += 1
+        material = CourseMaterial.objects.create(course=self.course, title=name, type='lecture', sequence=self.sequence)
+        return Lecture.objects.create(material=material, content='...', document=SimpleUploadedFile(name, data))
+
+    def blob_files(self):
+        return [files for _, _, files in os.walk(self.storage.path(blobs.BLOB_DIR)) if files]
+
+    def test_identical_uploads_are_stored_once(self):
+        pdf = b'%PDF-1.4\n' + os.urandom(100_000)
+        first = self.lecture('slides.pdf', pdf)
+        second = self.lecture('copy of slides.bin', pdf)
+
+        self.assertEqual(first.document.name, second.document.name)
+        self.assertEqual(len(self.blob_files()), 1)
+        blob = Blob.objects.get()
+        self.assertEqual((blob.size, blob.mime_type, blob.ref_count), (len(pdf), 'application/pdf', 2))
+        # The type comes from the content rather than the name
+        self.assertEqual(second.document_mime_type, 'application/pdf')
+        self.assertEqual(second.document_name, 'copy of slides.bin')
+        with self.storage.open(first.document.name) as stored:
+            self.assertEqual(stored.read(), pdf)
+
+    def test_sniffing(self):
+        self.assertEqual(blobs.sniff(b'\x89PNG\r\n\x1a\n....', 'diagram.pdf'), 'image/png')
+        self.assertEqual(blobs.sniff(b'PK\x03\x04....', 'deck.pptx'), 'application/vnd.openxmlformats-officedocument.presentationml.presentation')
+        self.assertEqual(blobs.sniff(b'PK\x03\x04....', 'deck.png'), 'application/zip')
+        self.assertEqual(blobs.sniff('Notes \u00e9'.encode()[:-1], 'notes.md'), 'text/markdown')
+        self.assertEqual(blobs.sniff(b'\x00\x01\x02', 'notes.txt'), 'application/octet-stream')
+
+    def test_unreferenced_blobs_are_collected_after_the_grace_period(self):
+        shared = self.lecture('a.txt', b'shared notes')
+        self.lecture('b.txt', b'shared notes')
+        replaced = self.lecture('c.txt', b'first draft')
+        replaced.document = SimpleUploadedFile('c.txt', b'second draft')
+        replaced.save()
+        shared.material.delete()
+
+        self.assertEqual(
+            dict(Blob.objects.values_list('size', 'ref_count')),
+            {len(b'shared notes'): 1, len(b'first draft'): 0, len(b'second draft'): 1},
+        )
+        self.assertEqual(blobs.collect(self.storage), (0, 0))
+
+        later = timezone.now() + blobs.GC_GRACE
+        self.assertEqual(blobs.collect(self.storage, now=later), (1, len(b'first draft')))
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(len(self.blob_files()), 2)
+
+    def test_collect_command_removes_stray_files(self):
+        self.lecture('a.txt', b'kept')
+        stray = self.storage.path(f'{blobs.BLOB_DIR}/.upload-interrupted')
+        with open(stray, 'wb') as f:
+            f.write(b'partial')
+        os.utime(stray, (0, 0))
+
+        out = StringIO()
+        call_command('collect_blobs', '--dry-run', stdout=out)
+        self.assertIn('Would delete 0 blobs, freeing 7 bytes', out.getvalue())
+        self.assertTrue(os.path.exists(stray))
+        call_command('collect_blobs', stdout=StringIO())
+        self.assertFalse(os.path.exists(stray))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
@@ -0,0 +1,323 @@
+import io
+import tempfile
+from datetime import timedelta
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from PIL import Image
+from uniworld import enrollment, media, notifications, outbox, previews, tasks
+from uniworld.models import Course, CourseMaterial, EnrollmentEvent, Lecture, PendingNotification
+
+User = get_user_model()
+
+class MaterialNotificationTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.course.students.add(*[
+            User.objects.create_user(username=f'student{i}', password='12345', email=f'student{i}@example.com')
+            for i in range(5)
+        ])
+        self.course.students.add(User.objects.create_user(username='noemail', password='12345'))
+
+    def test_fan_out_splits_roster_into_chunks(self):
+        with mock.patch.object(tasks, 'EMAIL_CHUNK_SIZE', 2), \
+                mock.patch.object(tasks.send_email_chunk, 'delay') as delay:
+            chunks = tasks.fan_out_email('Subject', 'Message', self.course.students.exclude(email='').values_list('email', flat=True))
+
+        self.assertEqual(chunks, 3)
+        chunks = [call.args[0] for call in delay.call_args_list]
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sorted(recipient for chunk in chunks for _, _, recipient in chunk),
+                         [f'student{i}@example.com' for i in range(5)])
+
+    def test_chunk_reuses_one_connection(self):
+        with mock.patch('uniworld.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            tasks.send_email_chunk.apply(args=[[
+                ['Subject', 'Message', 'a@example.com'],
+                ['Subject', 'Message', 'b@example.com'],
+            ]])
+
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com']])
+
+    def failing_at(self, failures):
+        """Patch the test mail backend to raise failures[recipient] for those recipients."""
+        send_messages = locmem.EmailBackend.send_messages
+
+        def send(backend, messages):
+            for message in messages:
+                if message.to[0] in failures:
+                    raise failures[message.to[0]]
+            return send_messages(backend, messages)
+        return mock.patch.object(locmem.EmailBackend, 'send_messages', send)
+
+    def chunk(self, *recipients):
+        return [['Subject', 'Message', recipient] for recipient in recipients]
+
+    def test_failed_chunk_retries_only_unsent_messages(self):
+        with self.failing_at({'b@example.com': SMTPServerDisconnected()}), \
+                mock.patch.object(tasks.send_email_chunk, 'retry', side_effect=SMTPException) as retry:
+            result = tasks.send_email_chunk.apply(args=[self.chunk('a@example.com', 'b@example.com', 'c@example.com')])
+
+        self.assertTrue(result.failed())
+        self.assertEqual(retry.call_args.kwargs['args'], [self.chunk('b@example.com', 'c@example.com')])
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
+
+    def test_refused_recipients_are_dropped(self):
+        refused = SMTPRecipientsRefused({'b@example.com': (550, b'No such user')})
+        with self.failing_at({'b@example.com': refused}), \
+                mock.patch.object(tasks.send_email_chunk, 'retry') as retry:
+            result = tasks.send_email_chunk.apply(args=[self.chunk('a@example.com', 'b@example.com', 'c@example.com')])
+
+        self.assertTrue(result.successful())
+        retry.assert_not_called()
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['c@example.com']])
+
+class NotificationDigestTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.student = User.objects.create_user(username='student', password='12345', email='student@example.com')
+        self.hourly = User.objects.create_user(username='hourly', password='12345', email='hourly@example.com')
+        self.hourly.profile.notification_frequency = 'hourly'
+        self.hourly.profile.save()
+        self.course.students.add(self.student, self.hourly)
+        with mock.patch.object(tasks.buffer_material_notification, 'delay'):
+            self.material = CourseMaterial.objects.create(course=self.course, title='Week 1', type='lecture', sequence=1)
+
+    def collect(self, now=None):
+        digests = []
+        notifications.collect_digests(digests.extend, now)
+        return digests
+
+    def test_repeated_edits_collapse_into_one_digest(self):
+        tasks.buffer_material_notification(self.course.pk, self.material.pk, True)
+        for _ in range(5):
+            tasks.buffer_material_notification(self.course.pk, self.material.pk, False)
+        self.assertEqual(PendingNotification.objects.filter(recipient=self.student).count(), 2)
+
+        digests = self.collect()
+        self.assertEqual(len(digests), 1)
+        subject, message, email = digests[0]
+        self.assertEqual(email, 'student@example.com')
+        self.assertIn('"Week 1" has been added', message)
+        self.assertNotIn('updated', message)
+        self.assertFalse(PendingNotification.objects.filter(recipient=self.student).exists())
+
+    def test_digest_waits_for_preferred_window(self):
+        tasks.buffer_material_notification(self.course.pk, self.material.pk, False)
+        self.collect()
+        self.assertEqual(self.collect(), [])
+
+        later = timezone.now() + timedelta(hours=1, minutes=1)
+        self.assertEqual([email for _, _, email in self.collect(later)], ['hourly@example.com'])
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_digests_are_collected_in_batches(self):
+        tasks.buffer_material_notification(self.course.pk, self.material.pk, True)
+        later = timezone.now() + timedelta(hours=1, minutes=1)
+        with mock.patch.object(notifications, 'DIGEST_BATCH_SIZE', 1):
+            digests = self.collect(later)
+        self.assertEqual(sorted(email for _, _, email in digests), ['hourly@example.com', 'student@example.com'])
+        self.assertFalse(PendingNotification.objects.exists())
+
+    def test_failed_send_keeps_events(self):
+        tasks.buffer_material_notification(self.course.pk, self.material.pk, True)
+        with self.assertRaises(OSError):
+            notifications.collect_digests(mock.Mock(side_effect=OSError))
+        self.assertEqual(PendingNotification.objects.count(), 2)
+        self.assertEqual([email for _, _, email in self.collect()], ['student@example.com'])
+
+    def test_recipients_without_a_profile_get_the_default_frequency(self):
+        self.student.profile.delete()
+        tasks.buffer_material_notification(self.course.pk, self.material.pk, True)
+        self.assertEqual([email for _, _, email in self.collect()], ['student@example.com'])
+
+    def test_material_is_buffered_only_once_committed(self):
+        with mock.patch.object(tasks.buffer_material_notification, 'delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                material = CourseMaterial.objects.create(course=self.course, title='Week 2', type='lecture', sequence=2)
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once_with(self.course.pk, material.pk, True)
+
+class EnrollmentOutboxTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345', email='teacher@example.com')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.students = [
+            User.objects.create_user(username=f'student{i}', password='12345', first_name='Jo', last_name=f'S{i}',
+                                     email=f'student{i}@example.com')
+            for i in range(3)
+        ]
+
+    def events(self):
+        return list(EnrollmentEvent.objects.order_by('pk').values_list('student_id', 'action'))
+
+    def test_one_event_per_actual_change(self):
+        self.course.students.add(*self.students)
+        self.course.students.add(self.students[0])
+        self.students[1].enrolled_courses.remove(self.course)
+        self.course.students.remove(self.students[1])
+        self.course.blocked_students.add(self.students[2])
+        self.course.students.clear()
+
+        self.assertEqual(self.events(), [
+            (self.students[0].pk, 'enrolled'),
+            (self.students[1].pk, 'enrolled'),
+            (self.students[2].pk, 'enrolled'),
+            (self.students[1].pk, 'removed'),
+            (self.students[2].pk, 'blocked'),
+            (self.students[0].pk, 'removed'),
+            (self.students[2].pk, 'removed'),
+        ])
+
+    def test_course_save_records_nothing(self):
+        self.course.students.add(self.students[0])
+        self.course.name = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            self.course.save()
+        self.assertFalse(any('uniworld_course_students' in query['sql'] for query in queries))
+        self.assertEqual(EnrollmentEvent.objects.count(), 1)
+
+    def test_drain_batches_events_once(self):
+        self.course.students.add(*self.students)
+        self.course.blocked_students.add(self.students[0])
+        sent = []
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.drain(sent.extend), 4)
+        self.assertEqual(outbox.drain(sent.extend), 0)
+
+        self.assertEqual(sorted(recipient for _, _, recipient in sent), ['student0@example.com', 'teacher@example.com'])
+        teacher_message = next(message for _, message, recipient in sent if recipient == 'teacher@example.com')
+        self.assertTrue(teacher_message.startswith('3 students have enrolled in your course "Test Course"'))
+        self.assertFalse(EnrollmentEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+    def test_removals_notify_the_student_and_leaving_notifies_the_teacher(self):
+        self.course.students.add(*self.students)
+        EnrollmentEvent.objects.update(dispatched_at=timezone.now())
+        client = Client()
+        client.login(username='student0', password='12345')
+        client.post(reverse('course-leave', args=[self.course.pk]))
+        client.login(username='teacher', password='12345')
+        client.post(reverse('remove-student', args=[self.course.pk, self.students[1].pk]))
+        # Made outside any view, so on the teacher's behalf
+        self.course.students.remove(self.students[2])
+
+        sent = []
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(outbox.drain(sent.extend), 3)
+        self.assertEqual(sorted((recipient, subject) for subject, _, recipient in sent), [
+            ('student1@example.com', 'You Have Been Removed from a Course'),
+            ('student2@example.com', 'You Have Been Removed from a Course'),
+            ('teacher@example.com', 'Student Left Your Course'),
+        ])
+        self.assertEqual(next(message for _, message, recipient in sent if recipient == 'teacher@example.com'),
+                         'Jo S0 has left your course "Test Course".')
+
+    def test_blocking_an_enrolled_student_sends_one_notice(self):
+        self.course.students.add(self.students[0])
+        EnrollmentEvent.objects.update(dispatched_at=timezone.now())
+        client = Client()
+        client.login(username='teacher', password='12345')
+        client.post(reverse('block-student', args=[self.course.pk, self.students[0].pk]))
+        self.assertEqual(self.events()[-2:], [(self.students[0].pk, 'removed'), (self.students[0].pk, 'blocked')])
+
+        sent = []
+        outbox.drain(sent.extend)
+        self.assertEqual([(recipient, subject) for subject, _, recipient in sent],
+                         [('student0@example.com', 'You Have Been Removed from a Course')])
+
+    def test_teacher_is_not_told_about_their_own_import(self):
+        self.course.students.add(self.students[0])
+        rows = enrollment.parse_pasted('student1@example.com, student2@example.com')
+        with mock.patch.object(tasks.notify_students_of_addition, 'delay'):
+            enrollment.run_import(enrollment.create_import(self.course, self.teacher, rows))
+
+        sent = []
+        self.assertEqual(outbox.drain(sent.extend), 3)
+        self.assertEqual([(recipient, message) for _, message, recipient in sent],
+                         [('teacher@example.com', 'Jo S0 has enrolled in your course "Test Course".')])
+
+    def test_failed_send_leaves_events_for_the_next_run(self):
+        self.course.students.add(*self.students)
+        with self.assertRaises(OSError):
+            outbox.drain(mock.Mock(side_effect=OSError))
+        self.assertEqual(EnrollmentEvent.objects.filter(dispatched_at__isnull=True).count(), 3)
+
+        sent = []
+        self.assertEqual(outbox.drain(sent.extend), 3)
+        self.assertFalse(EnrollmentEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+class DocumentPreviewTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.student = User.objects.create_user(username='student', password='12345')
+        self.outsider = User.objects.create_user(username='outsider', password='12345')
+        self.course = Course.objects.create(name='Test Course', description='Test Description', teacher=self.teacher)
+        self.course.students.add(self.student)
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, name, data, sequence=1):
+        material = CourseMaterial.objects.create(course=self.course, title=name, type='lecture', sequence=sequence)
+        with mock.patch.object(tasks.generate_document_previews, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            lecture = Lecture.objects.create(material=material, content='...', document=SimpleUploadedFile(name, data))
+        return lecture, delay
+
+    def photo(self, mode='RGB', size=(2000, 1000)):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG' if 'A' in mode else 'JPEG')
+        return buffer.getvalue()
+
+    def test_image_variants_are_rendered_once_per_content(self):
+        lecture, delay = self.upload('photo.jpg', self.photo())
+        delay.assert_called_once_with(lecture.document.name, 'image/jpeg')
+        self.assertIsNone(previews.urls(lecture))
+
+        self.assertEqual(tasks.generate_document_previews(lecture.document.name, 'image/jpeg'), 2)
+        variants = previews.names(lecture.document.name, 'image/jpeg')
+        for variant, size in [('preview', (1024, 512)), ('thumb', (256, 128))]:
+            with Image.open(default_storage.path(variants[variant])) as image:
+                self.assertEqual((image.format, image.size), ('JPEG', size))
+        self.assertEqual(set(previews.urls(lecture)), {'preview', 'thumb'})
+
+        # The same photo in another lecture reuses what was rendered
+        copy, _ = self.upload('copy.jpg', self.photo(), sequence=2)
+        self.assertEqual(tasks.generate_document_previews(copy.document.name, 'image/jpeg'), 0)
+        self.assertTrue(media.can_read(self.student, variants['preview']))
+        self.assertFalse(media.can_read(self.outsider, variants['preview']))
+
+    def test_transparent_images_are_flattened(self):
+        lecture, _ = self.upload('diagram.png', self.photo('RGBA', (300, 300)))
+        tasks.generate_document_previews(lecture.document.name, 'image/png')
+        with Image.open(default_storage.path(previews.names(lecture.document.name, 'image/png')['thumb'])) as image:
+            self.assertEqual((image.mode, image.size), ('RGB', (256, 256)))
+
+    def test_pdfs_fall_back_without_a_renderer(self):
+        lecture, delay = self.upload('slides.pdf', b'%PDF-1.4\n...')
+        delay.assert_called_once()
+        with mock.patch.object(previews.shutil, 'which', return_value=None):
+            self.assertEqual(tasks.generate_document_previews(lecture.document.name, 'application/pdf'), 0)
+        self.assertIsNone(previews.urls(lecture))
+
+    def test_other_documents_are_not_rendered(self):
+        _, delay = self.upload('notes.txt', b'plain notes')
+        delay.assert_not_called()
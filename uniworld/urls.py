@@ -30,17 +30,24 @@ urlpatterns = [
     path('course/<int:course_id>/remove-student/<int:student_id>/', RemoveStudentView.as_view(), name='remove-student'),
     path('course/<int:course_id>/block-student/<int:student_id>/', BlockStudentView.as_view(), name='block-student'),
     path('course/<int:course_id>/add-students/', AddStudentsView.as_view(), name='add-students'),
+    path('course/<int:course_id>/imports/<int:pk>/', EnrollmentImportView.as_view(), name='enrollment-import'),
     path('student-search/', StudentSearchView.as_view(), name='student-search'),
     path('course/<int:course_id>/enroll/', CourseEnrollView.as_view(), name='course_enroll'),
     path('courses/<int:course_id>/unblock-student/<int:student_id>/', UnblockStudentView.as_view(), name='unblock-student'),
     path('search/', SearchView.as_view(), name='search'),
     path('course/<int:course_id>/feedback/', CourseFeedbackView.as_view(), name='course-feedback'),
     path('assignment/<int:assignment_id>/submit/', SubmitAssignmentView.as_view(), name='submit-assignment'),
+    path('submission-receipt/<uuid:pk>/', SubmissionReceiptView.as_view(), name='submission-receipt'),
     path('course/material/<int:pk>/edit/', EditCourseMaterialView.as_view(), name='edit-course-material'),
     path('assignment/<int:assignment_id>/add-question/', AddAssignmentQuestionView.as_view(), name='add-assignment-question'),
+    path('assignment/<int:assignment_id>/analysis/', ItemAnalysisView.as_view(), name='item-analysis'),
     path('course-material/<int:pk>/delete/', DeleteCourseMaterialView.as_view(), name='delete-course-material'),
     path('assignment-question/<int:pk>/delete/', DeleteAssignmentQuestionView.as_view(), name='delete-assignment-question'),
     path('course/<int:course_id>/submissions/', CourseSubmissionsView.as_view(), name='course-submissions'),
+    path('course/<int:course_id>/gradebook/', GradebookView.as_view(), name='course-gradebook'),
+    path('course/<int:course_id>/grading-queue/', GradingQueueView.as_view(), name='grading-queue'),
+    path('deadlines/<str:token>.ics', DeadlineCalendarView.as_view(), name='deadline-calendar'),
+    path('deadlines/reset/', ResetDeadlineCalendarView.as_view(), name='deadline-calendar-reset'),
     path('submission/<int:pk>/', ViewSubmissionView.as_view(), name='view-submission'),
     path('submission/<int:pk>/grade/', GradeSubmissionView.as_view(), name='grade-submission'),
     path('course/<int:course_id>/my-submissions/', MySubmissionsView.as_view(), name='my-submissions'),
@@ -1,13 +1,15 @@
 from django.contrib import messages
 from django.contrib.auth import get_user_model
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.contrib.auth.models import Group
-from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag, urlencode
 from django.views import View
 from django.views.generic import ListView
 from django.views.generic.detail import DetailView
@@ -15,22 +17,28 @@ from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from rest_framework import viewsets
 from rules.contrib.views import AutoPermissionRequiredMixin
 from rules.contrib.rest_framework import AutoPermissionViewSetMixin
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.response import Response
 
 from chat.models import Room
+from uniworld import analysis, autocomplete, deadlines, enrollment, gradebook, grading, grading_queue, materials, media, membership, previews, search, submissions, xlsx
 from uniworld.forms import CourseMaterialForm, LectureForm, AssignmentForm, AssignmentQuestionForm, MCQOptionFormSet
 from uniworld.models import (
     Course, CourseMaterial, Lecture, Assignment, AssignmentSubmission,
-    AssignmentQuestion, QuestionResponse, MCQOption, Feedback
+    AssignmentQuestion, QuestionResponse, MCQOption, Feedback, EnrollmentImport, SubmissionReceipt
 )
 from uniworld.serializers import (
     CourseSerializer, CourseMaterialSerializer, LectureSerializer,
     AssignmentSerializer, AssignmentQuestionSerializer,
     AssignmentSubmissionSerializer, QuestionResponseSerializer,
-    MCQOptionSerializer, FeedbackSerializer
+    MCQOptionSerializer, FeedbackSerializer, GradeBatchSerializer, MaterialOrderSerializer
 )
+from uniworld.pagination import KeysetPaginator
+from uniworld.rosters import ROSTER_ORDERING, roster_paginator, roster_total
+from uniworld.tasks import process_enrollment_import
 
-import re
+import time
 
 def heartbeat(request):
     return HttpResponse("alive")
@@ -46,14 +54,15 @@ class CourseListView(LoginRequiredMixin, ListView):
     context_object_name = 'course_list'
 
     def get_queryset(self):
-        queryset = Course.objects.exclude(blocked_students=self.request.user)
+        index = membership.get_index(self.request.user)
+        queryset = Course.objects.exclude(pk__in=index.blocked).select_related('stats', 'teacher__profile')
         filter_param = self.request.GET.get('filter')
 
         if filter_param == 'my_courses':
             if self.request.user.groups.filter(name='teachers').exists():
-                queryset = queryset.filter(teacher=self.request.user)
+                queryset = queryset.filter(pk__in=index.taught)
             else:
-                queryset = queryset.filter(students=self.request.user)
+                queryset = queryset.filter(pk__in=index.enrolled)
 
         return queryset
 
@@ -70,37 +79,41 @@ class CourseDetailView(AutoPermissionRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         enrolled_students_list = self.object.students.all()
-        
+        search_query = ''
+
         if self.request.user == self.object.teacher:
-            search_query = self.request.GET.get('search')
+            search_query = self.request.GET.get('search', '')
             if search_query:
                 enrolled_students_list = enrolled_students_list.filter(
                     Q(first_name__icontains=search_query) | 
                     Q(last_name__icontains=search_query) |
                     Q(email__icontains=search_query)
                 )
-        
-        enrolled_students_list = enrolled_students_list.order_by('last_name', 'first_name')
-        
-        paginator = Paginator(enrolled_students_list, 10)  # Show 10 students per page
-        page_number = self.request.GET.get('page')
-        enrolled_students = paginator.get_page(page_number)
 
-        blocked_students_list = self.object.blocked_students.all().order_by('last_name', 'first_name')
-        blocked_paginator = Paginator(blocked_students_list, 10)  # Show 10 blocked students per page
-        blocked_page_number = self.request.GET.get('blocked_page')
-        blocked_students = blocked_paginator.get_page(blocked_page_number)
+        # Cursor pagination keeps deep pages as cheap as the first one on large rosters
+        enrolled_students = roster_paginator(enrolled_students_list).get_page(self.request.GET.get('cursor'))
+        blocked_students = roster_paginator(self.object.blocked_students.all()).get_page(
+            self.request.GET.get('blocked_cursor')
+        )
 
         context['enrolled_students'] = enrolled_students
         context['blocked_students'] = blocked_students
-        context['is_enrolled'] = self.request.user in self.object.students.all()
+        context['search_query'] = search_query
+        if not search_query:
+            context['enrolled_total'] = roster_total(self.object.pk, 'students')
+        if self.request.user == self.object.teacher:
+            context['blocked_total'] = roster_total(self.object.pk, 'blocked_students')
+            context['enrollment_import'] = self.object.enrollment_imports.order_by('-created_at').first()
+        context['is_enrolled'] = membership.is_enrolled(self.request.user, self.object.pk)
+        if self.request.user != self.object.teacher:
+            context['is_assistant'] = membership.is_assistant(self.request.user, self.object.pk)
         context['feedback_list'] = self.object.feedback.all().order_by('-created_at')
         return context
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         if request.user.is_authenticated and request.user != self.object.teacher:
-            if request.user not in self.object.students.all():
+            if not membership.is_enrolled(request.user, self.object.pk):
                 self.object.students.add(request.user)
                 messages.success(request, f"You have successfully enrolled in {self.object.name}.")
             else:
@@ -148,6 +161,7 @@ class CourseLeaveView(LoginRequiredMixin, View):
         if not request.user.has_perm(Course.get_perm('leave_course'), course):
             return HttpResponseForbidden("You don't have permission to leave this course.")
 
+        course._roster_changed_by = request.user
         course.students.remove(request.user)
         messages.success(request, f"You have successfully left the course '{course.name}'.")
         return redirect('course-view', pk=pk)
@@ -160,6 +174,7 @@ class RemoveStudentView(LoginRequiredMixin, View):
             return HttpResponseForbidden("You don't have permission to remove students from this course.")
 
         student = get_object_or_404(course.students, pk=student_id)
+        course._roster_changed_by = request.user
         course.students.remove(student)
         messages.success(request, f"{student.first_name} {student.last_name} has been removed from the course.")
         
@@ -174,14 +189,15 @@ class BlockStudentView(LoginRequiredMixin, View):
         
         try:
             student = get_user_model().objects.get(pk=student_id)
+            course._roster_changed_by = request.user
             
             # If the student is enrolled, unenroll them first
-            if student in course.students.all():
+            if membership.is_enrolled(student, course.pk):
                 course.students.remove(student)
                 messages.info(request, f"{student.first_name} {student.last_name} has been unenrolled from the course.")
             
             # Block the student
-            if student not in course.blocked_students.all():
+            if not membership.is_blocked(student, course.pk):
                 course.blocked_students.add(student)
                 messages.success(request, f"{student.first_name} {student.last_name} has been blocked from the course.")
             else:
@@ -199,44 +215,62 @@ class AddStudentsView(LoginRequiredMixin, View):
         if not request.user.has_perm(Course.get_perm('enroll_student'), course):
             return HttpResponseForbidden("You don't have permission to add students to this course.")
 
-        student_emails = request.POST.get('student_emails', '').split(',')
-        student_emails = [re.search(r'[\w\.-]+@[\w\.-]+', email).group() for email in student_emails]
-        
-        added_count = 0
-        for email in student_emails:
-            try:
-                student = get_user_model().objects.get(email=email)
-                if student not in course.students.all() and student not in course.blocked_students.all():
-                    course.students.add(student)
-                    added_count += 1
-            except get_user_model().DoesNotExist:
-                pass
-        
-        messages.success(request, f"{added_count} student(s) have been added to the course.")
+        try:
+            if 'student_csv' in request.FILES:
+                rows = enrollment.parse_csv(request.FILES['student_csv'])
+            else:
+                rows = enrollment.parse_pasted(request.POST.get('student_emails', ''))
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('course-view', pk=course_id)
+
+        if not rows:
+            messages.error(request, "Please select or upload at least one student to add.")
+            return redirect('course-view', pk=course_id)
+
+        enrollment_import = enrollment.create_import(course, request.user, rows)
+        if enrollment_import.total > enrollment.ASYNC_THRESHOLD:
+            transaction.on_commit(lambda: process_enrollment_import.delay(enrollment_import.pk))
+            messages.info(request, f"Importing {enrollment_import.total} student(s) in the background.")
+            return redirect('course-view', pk=course_id)
+
+        enrollment.run_import(enrollment_import)
+        messages.success(request, f"{enrollment_import.added_count} student(s) have been added to the course.")
+        if enrollment_import.errors:
+            messages.warning(request, f"{len(enrollment_import.errors)} row(s) could not be imported.")
         return redirect('course-view', pk=course_id)
 
 
+class EnrollmentImportView(LoginRequiredMixin, View):
+    def get(self, request, course_id, pk):
+        enrollment_import = get_object_or_404(EnrollmentImport, pk=pk, course_id=course_id)
+        if not request.user.has_perm(Course.get_perm('enroll_student'), enrollment_import.course):
+            return HttpResponseForbidden("You don't have permission to view this import.")
+
+        return JsonResponse({
+            'status': enrollment_import.status,
+            'total': enrollment_import.total,
+            'processed': enrollment_import.processed,
+            'progress': enrollment_import.progress,
+            'added': enrollment_import.added_count,
+            'errors': enrollment_import.errors,
+        })
+
+
 class StudentSearchView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
+        started = time.perf_counter()
         term = request.GET.get('term', '')
         course_id = request.GET.get('course_id')
         course = get_object_or_404(Course, pk=course_id)
         if not request.user.has_perm(Course.get_perm('enroll_student'), course):
             return HttpResponseForbidden("You don't have permission to enroll students in this course.")
-        
-        User = get_user_model()
-        students_group = Group.objects.get(name='students')
-        students = User.objects.filter(
-            Q(first_name__icontains=term) | 
-            Q(last_name__icontains=term) | 
-            Q(email__icontains=term),
-            groups=students_group
-        ).exclude(
-            enrolled_courses__id=course_id
-        )[:10]
-        
-        results = [{'label': f"{s.first_name} {s.last_name} ({s.email})", 'value': s.email} for s in students]
-        return JsonResponse(results, safe=False)
+
+        results = autocomplete.suggest_students(term, course.pk)
+
+        response = JsonResponse(results, safe=False)
+        response['Server-Timing'] = f'autocomplete;dur={(time.perf_counter() - started) * 1000:.2f}'
+        return response
 
 
 class CourseEnrollView(LoginRequiredMixin, View):
@@ -247,11 +281,11 @@ class CourseEnrollView(LoginRequiredMixin, View):
 
         user = request.user
 
-        if user in course.blocked_students.all():
+        if membership.is_blocked(user, course.pk):
             messages.error(request, "You are blocked from enrolling in this course.")
             return redirect('course-view', pk=course_id)
 
-        if user not in course.students.all():
+        if not membership.is_enrolled(user, course.pk):
             course.students.add(user)
             messages.success(request, "You have successfully enrolled in the course.")
         else:
@@ -275,30 +309,7 @@ class UnblockStudentView(LoginRequiredMixin, View):
 class SearchView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         query = request.GET.get('q', '')
-        results = []
-
-        if query:
-            # Search courses
-            courses = Course.objects.filter(name__icontains=query)
-            for course in courses:
-                results.append({
-                    'label': course.name,
-                    'url': reverse('course-view', args=[course.pk])
-                })
-
-            # Search users in 'teachers' or 'students' groups
-            User = get_user_model()
-            users = User.objects.filter(
-                Q(groups__name='teachers') | Q(groups__name='students'),
-                Q(first_name__icontains=query) | Q(last_name__icontains=query) | Q(email__icontains=query)
-            )
-            for user in users:
-                results.append({
-                    'label': f"{user.first_name} {user.last_name} ({user.email})",
-                    'url': reverse('profile', args=[user.pk])
-                })
-
-        return JsonResponse({'results': results})
+        return JsonResponse({'results': search.search(query)})
 
 class CourseFeedbackView(LoginRequiredMixin, View):
     def post(self, request, course_id):
@@ -327,15 +338,19 @@ class CourseMaterialListView(LoginRequiredMixin, ListView):
     template_name = 'uniworld/course_material.html'
     context_object_name = 'course_material'
 
-    def get_queryset(self):
-        course = get_object_or_404(Course, pk=self.kwargs['course_id'])
-        if not self.request.user.has_perm(Course.get_perm('view'), course):
+    def get(self, request, *args, **kwargs):
+        self.course = get_object_or_404(Course, pk=self.kwargs['course_id'])
+        if not request.user.has_perm(Course.get_perm('view'), self.course):
             return HttpResponseForbidden("You don't have permission to view this course material.")
-        return course.materials.all()
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        # The lecture or assignment behind each item comes with it, so the listing is one query
+        return self.course.materials.select_related('lecture', 'assignment').order_by('sequence', 'pk')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['course'] = get_object_or_404(Course, pk=self.kwargs['course_id'])
+        context['course'] = self.course
         return context
 
 class AddCourseMaterialView(LoginRequiredMixin, View):
@@ -402,39 +417,54 @@ class CourseMaterialDetailView(AutoPermissionRequiredMixin, DetailView):
             context['lecture'] = lecture
             context['is_image'] = lecture.document_mime_type and lecture.document_mime_type.startswith("image/")
             context['is_pdf'] = lecture.document_mime_type and lecture.document_mime_type.startswith("application/pdf")
+            # Small rendered previews, once a worker has made them; until then the page falls back to the original
+            context['previews'] = previews.urls(lecture) if lecture.document else None
         elif material.type == 'assignment':
             context['assignment'] = get_object_or_404(Assignment, material=material)
         return context
     
 class SubmitAssignmentView(LoginRequiredMixin, View):
     def post(self, request, assignment_id):
-        assignment = get_object_or_404(Assignment, pk=assignment_id)
+        assignment = get_object_or_404(Assignment.objects.select_related('material__course'), pk=assignment_id)
         course = assignment.material.course
         if not request.user.has_perm(Course.get_perm('add_submission'), course):
             return HttpResponseForbidden("You don't have permission to submit assignments for this course.")
-        
-        submission = AssignmentSubmission.objects.create(
-            assignment=assignment,
-            student=request.user
-        )
 
-        for question in assignment.questions.all():
-            answer = request.POST.get(f'question_{question.id}')
-            if question.question_type == 'MCQ':
-                selected_option = get_object_or_404(MCQOption, pk=answer)
-                QuestionResponse.objects.create(
-                    submission=submission,
-                    question=question,
-                    selected_option=selected_option
-                )
-            elif question.question_type == 'ESSAY':
-                QuestionResponse.objects.create(
-                    submission=submission,
-                    question=question,
-                    response_text=answer
-                )
+        answers = submissions.parse_answers(request.POST)
+        cleaned, errors = submissions.validate_answers(assignment.pk, answers)
+        if errors:
+            for error in errors:
+                messages.error(request, error)
+            return redirect('course-material-view', pk=assignment.pk)
+
+        if submissions.is_queued(assignment):
+            # Near the deadline only the receipt is written here; a worker expands it
+            receipt = submissions.queue_submission(assignment.pk, request.user, answers)
+            messages.success(
+                request,
+                f"Your assignment was received at {timezone.localtime(receipt.received_at):%H:%M:%S}. "
+                f"You can check its status at {reverse('submission-receipt', args=[receipt.pk])}",
+            )
+            return redirect('course-material', course_id=course.id)
 
-        return redirect('course-material', course_id=assignment.material.course.id)
+        submissions.create_submission(assignment.pk, request.user, cleaned)
+        messages.success(request, 'Your assignment has been submitted.')
+        return redirect('course-material', course_id=course.id)
+
+
+class SubmissionReceiptView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        receipt = get_object_or_404(SubmissionReceipt, pk=pk)
+        if receipt.student_id != request.user.pk:
+            return HttpResponseForbidden("You don't have permission to view this receipt.")
+
+        return JsonResponse({
+            'receipt': str(receipt.pk),
+            'status': receipt.status,
+            'received_at': receipt.received_at.isoformat(),
+            'error': receipt.error,
+            'submission': reverse('view-submission', args=[receipt.submission_id]) if receipt.submission_id else None,
+        })
 
 class EditCourseMaterialView(AutoPermissionRequiredMixin, UpdateView):
     model = CourseMaterial
@@ -535,22 +565,167 @@ class DeleteAssignmentQuestionView(AutoPermissionRequiredMixin, DeleteView):
         response = super().delete(request, *args, **kwargs)
         return response
 
-class CourseSubmissionsView(LoginRequiredMixin, ListView):
-    model = AssignmentSubmission
-    template_name = 'uniworld/course_submissions.html'
-    context_object_name = 'submissions'
-
-    def get_queryset(self):
-        course = get_object_or_404(Course, pk=self.kwargs['course_id'])
-        if not self.request.user.has_perm(Course.get_perm('add_course_material'), course):
+class CourseSubmissionsView(LoginRequiredMixin, View):
+    def get(self, request, course_id):
+        course = get_object_or_404(Course, pk=course_id)
+        if not request.user.has_perm(Course.get_perm('grade_submissions'), course):
             return HttpResponseForbidden("You don't have permission to view this course submissions.")
-        return AssignmentSubmission.objects.filter(assignment__material__course=course).order_by('-submitted_at')
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['course'] = Course.objects.get(pk=self.kwargs['course_id'])
-        return context
-    
+        assignments = submissions.assignment_summaries(course)
+        queryset, filters = submissions.filter_submissions(assignments, request.GET)
+        # Seeking on (submitted_at, id) keeps every page as cheap as the first on large courses
+        page = KeysetPaginator(queryset, submissions.LIST_ORDERING, submissions.LIST_PAGE_SIZE).get_page(
+            request.GET.get('cursor')
+        )
+        return render(request, 'uniworld/course_submissions.html', {
+            'course': course,
+            'submissions': page,
+            'assignments': assignments,
+            'pending_total': sum(assignment.pending for assignment in assignments),
+            'filters': filters,
+            'filter_query': urlencode(filters),
+            'filtered_student': get_user_model().objects.filter(pk=filters['student']).first() if 'student' in filters else None,
+        })
+
+class GradingQueueView(LoginRequiredMixin, View):
+    """Essay grading for course staff: claim a batch, score it, claim the next."""
+
+    def get(self, request, course_id):
+        course = get_object_or_404(Course, pk=course_id)
+        if not request.user.has_perm(Course.get_perm('grade_submissions'), course):
+            return HttpResponseForbidden("You don't have permission to grade this course's submissions.")
+
+        remaining, graders = grading_queue.progress(course)
+        return render(request, 'uniworld/grading_queue.html', {
+            'course': course,
+            'claims': grading_queue.active_claims(course, request.user),
+            'remaining': remaining,
+            'graders': graders,
+            'lease_minutes': int(grading_queue.LEASE.total_seconds() // 60),
+        })
+
+    def post(self, request, course_id):
+        course = get_object_or_404(Course, pk=course_id)
+        if not request.user.has_perm(Course.get_perm('grade_submissions'), course):
+            return HttpResponseForbidden("You don't have permission to grade this course's submissions.")
+
+        operation = request.POST.get('action')
+        if operation == 'claim':
+            if not grading_queue.claim(course, request.user):
+                messages.info(request, "There is nothing left to claim right now.")
+        elif operation == 'release':
+            grading_queue.release(course, request.user)
+        elif operation == 'grade':
+            self.grade(request, course)
+        return redirect('grading-queue', course_id=course.pk)
+
+    def grade(self, request, course):
+        # Only responses the user still holds are read, and apply_grades re-checks the claims under lock
+        scores = {}
+        for response_id in grading_queue.active_claims(course, request.user).values_list('pk', flat=True):
+            score = request.POST.get(f'score_{response_id}')
+            if score:
+                try:
+                    scores[response_id] = float(score)
+                except ValueError:
+                    messages.error(request, f"{score!r} is not a valid score.")
+                    return
+
+        _, errors = grading.check_grades(scores)
+        if errors:
+            for error in errors:
+                messages.error(request, error)
+            return
+        _, rejected = grading.apply_grades(scores, grader=request.user, claimed_only=True)
+        if rejected:
+            messages.warning(request, f"{len(rejected)} of your claims expired before you saved and were not graded.")
+        graded = len(scores) - len(rejected)
+        messages.success(request, f"Graded {graded} response{'s' if graded != 1 else ''}.")
+
+class GradebookView(LoginRequiredMixin, View):
+    EXPORTS = {
+        'csv': ('text/csv', gradebook.stream_csv),
+        'xlsx': (xlsx.CONTENT_TYPE, gradebook.stream_xlsx),
+    }
+
+    def get(self, request, course_id):
+        course = get_object_or_404(Course, pk=course_id)
+        if not request.user.has_perm(Course.get_perm('add_course_material'), course):
+            return HttpResponseForbidden("You don't have permission to view this gradebook.")
+
+        export = request.GET.get('format')
+        if export in self.EXPORTS:
+            content_type, stream = self.EXPORTS[export]
+            response = StreamingHttpResponse(stream(course), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="gradebook-{course.pk}.{export}"'
+            return response
+
+        assignments = gradebook.columns(course)
+        page = KeysetPaginator(
+            gradebook.matrix(course, assignments), ROSTER_ORDERING, gradebook.GRADEBOOK_PAGE_SIZE
+        ).get_page(request.GET.get('cursor'))
+        return render(request, 'uniworld/gradebook.html', {
+            'course': course,
+            'assignments': assignments,
+            'page': page,
+            'rows': [(student, gradebook.scores(student, assignments)) for student in page],
+        })
+
+class ProtectedMediaView(View):
+    """Uploaded files, served only to users allowed to see what they belong to."""
+
+    def get(self, request, name):
+        media.check_name(name)
+        if not media.can_read(request.user, name):
+            if not request.user.is_authenticated:
+                return redirect_to_login(request.get_full_path())
+            return HttpResponseForbidden("You don't have permission to view this file.")
+        return media.serve(request, name)
+
+class DeadlineCalendarView(View):
+    """
+    A student's upcoming deadlines as an iCalendar feed. Calendar apps can't
+    log in, so the secret token in the URL identifies the student instead.
+    """
+
+    def get(self, request, token):
+        user_id = deadlines.user_for_token(token)
+        if user_id is None:
+            raise Http404("Unknown calendar.")
+
+        upcoming = deadlines.upcoming(user_id)
+        etag = quote_etag(deadlines.calendar_etag(upcoming))
+        # Calendar apps poll often; an unchanged feed is answered from the cache alone
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = HttpResponse(
+            deadlines.render_calendar(upcoming, lambda deadline: request.build_absolute_uri(
+                reverse('course-material-view', args=[deadline.assignment_id])
+            )),
+            content_type='text/calendar; charset=utf-8',
+        )
+        response['ETag'] = etag
+        response['Content-Disposition'] = 'inline; filename="deadlines.ics"'
+        return response
+
+class ResetDeadlineCalendarView(LoginRequiredMixin, View):
+    def post(self, request):
+        deadlines.reset_calendar_token(request.user)
+        messages.success(request, "Your calendar link has been reset. Subscribe again with the new link.")
+        return redirect('profile', pk=request.user.pk)
+
+class ItemAnalysisView(LoginRequiredMixin, View):
+    def get(self, request, assignment_id):
+        assignment = get_object_or_404(Assignment.objects.select_related('material__course'), pk=assignment_id)
+        if not request.user.has_perm(Course.get_perm('add_course_material'), assignment.material.course):
+            return HttpResponseForbidden("You don't have permission to view this assignment's analysis.")
+        return render(request, 'uniworld/item_analysis.html', {
+            'assignment': assignment,
+            'analysis': analysis.analyse(assignment),
+        })
+
 class ViewSubmissionView(LoginRequiredMixin, View):
     def get(self, request, pk):
         submission = get_object_or_404(AssignmentSubmission, pk=pk)
@@ -558,7 +733,7 @@ class ViewSubmissionView(LoginRequiredMixin, View):
             return HttpResponseForbidden("You don't have permission to view this submission.")
 
         responses = submission.responses.all()
-        is_teacher = request.user == submission.assignment.material.course.teacher
+        is_teacher = request.user.has_perm(AssignmentSubmission.get_perm('change'), submission)
         is_student = request.user == submission.student
         context = {
             'submission': submission,
@@ -573,20 +748,28 @@ class GradeSubmissionView(LoginRequiredMixin, View):
         submission = get_object_or_404(AssignmentSubmission, pk=pk)
         if not request.user.has_perm(AssignmentSubmission.get_perm('change'), submission):
             return HttpResponseForbidden("You don't have permission to grade this submission.")
-        
-        feedback = request.POST.get('feedback')
 
-        # Update scores for essay questions
-        for response in submission.responses.filter(question__question_type='ESSAY'):
-            score = request.POST.get(f'score_{response.id}')
-            if score is not None:
-                response.score = float(score)
-                response.save()
-
-        # Calculate total score
-        submission.calculate_total_score()
-        submission.feedback = feedback
-        submission.save()
+        scores = {}
+        essays = submission.responses.filter(question__question_type='ESSAY').values_list('pk', flat=True)
+        for response_id in essays:
+            score = request.POST.get(f'score_{response_id}')
+            if score:
+                try:
+                    scores[response_id] = float(score)
+                except ValueError:
+                    messages.error(request, f"{score!r} is not a valid score.")
+                    return redirect('view-submission', pk=submission.pk)
+
+        _, errors = grading.check_grades(scores)
+        if errors:
+            for error in errors:
+                messages.error(request, error)
+            return redirect('view-submission', pk=submission.pk)
+
+        # One write per table and a single notification, sent after commit
+        _, rejected = grading.apply_grades(scores, {submission.pk: request.POST.get('feedback')}, grader=request.user)
+        if rejected:
+            messages.warning(request, f"{len(rejected)} response(s) are claimed by another grader and were left unchanged.")
 
         messages.success(request, 'Submission graded successfully. The student will be notified.')
         return redirect('view-submission', pk=submission.pk)
@@ -620,7 +803,7 @@ class StudentSubmissionsView(LoginRequiredMixin, ListView):
         return AssignmentSubmission.objects.filter(
             assignment__material__course=course,
             student=student
-        ).order_by('-submitted_at')
+        ).select_related('assignment__material').order_by('-submitted_at')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -638,6 +821,7 @@ class CourseMaterialViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
     permission_type_map = {
         **AutoPermissionViewSetMixin.permission_type_map,
         'create': None,
+        'reorder': None,
     }
 
     def create(self, request, *args, **kwargs):
@@ -649,6 +833,20 @@ class CourseMaterialViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
 
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'])
+    def reorder(self, request):
+        """Apply a complete new ordering of a course's material in one request."""
+        serializer = MaterialOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course = serializer.validated_data['course']
+        if not request.user.has_perm(Course.get_perm('add_course_material'), course):
+            raise PermissionDenied("You do not have permission to reorder this course's material.")
+
+        changed, errors = materials.reorder(course, serializer.validated_data['order'])
+        if errors:
+            raise ValidationError({'errors': errors})
+        return Response({'reordered': changed})
+
 class LectureViewSet(viewsets.ModelViewSet):
     queryset = Lecture.objects.all()
     serializer_class = LectureSerializer
@@ -702,6 +900,7 @@ class AssignmentSubmissionViewSet(AutoPermissionViewSetMixin, viewsets.ModelView
     permission_type_map = {
         **AutoPermissionViewSetMixin.permission_type_map,
         'create': None,
+        'grade': None,
     }
 
     def create(self, request, *args, **kwargs):
@@ -713,6 +912,25 @@ class AssignmentSubmissionViewSet(AutoPermissionViewSetMixin, viewsets.ModelView
 
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'])
+    def grade(self, request):
+        """Grade any number of essay responses, across submissions, in one request."""
+        serializer = GradeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        scores = {grade['response']: grade['score'] for grade in serializer.validated_data.get('grades', [])}
+        feedback = {entry['submission']: entry['feedback'] for entry in serializer.validated_data.get('feedback', [])}
+
+        course_ids, errors = grading.check_grades(scores, feedback)
+        if errors:
+            raise ValidationError({'errors': errors})
+        for course in Course.objects.filter(pk__in=course_ids).select_related('teacher'):
+            if not request.user.has_perm(Course.get_perm('grade_submissions'), course):
+                raise PermissionDenied("You do not have permission to grade submissions for this course.")
+
+        graded, rejected = grading.apply_grades(scores, feedback, grader=request.user)
+        # Responses under another grader's live claim are left to them
+        return Response({'graded': graded, 'rejected': rejected})
+
 class QuestionResponseViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
     queryset = QuestionResponse.objects.all()
     serializer_class = QuestionResponseSerializer
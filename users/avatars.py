@@ -0,0 +1,52 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+DEFAULT_AVATAR = 'avatar.jpg'
+VARIANT_DIR = 'avatars'
+# Square sizes, in pixels, that templates ask for
+SIZES = (32, 64, 300)
+FORMATS = (
+    ('webp', 'WEBP', '.webp', {'quality': 80, 'method': 6}),
+    ('jpeg', 'JPEG', '.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+
+def _rgb(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(storage, name):
+    """
+    Crop the avatar stored under name to a square and store every size in
+    every format. Files are named after a hash of their bytes, so they never
+    change once written and can be cached forever.
+
+    Returns {size: {format: stored name}} with sizes as strings, as kept in
+    Profile.avatar_variants.
+    """
+    largest = max(SIZES)
+    with storage.open(name) as file, Image.open(file) as image:
+        # Lets the JPEG decoder scale down while decoding instead of loading every pixel
+        image.draft('RGB', (largest, largest))
+        square = ImageOps.fit(_rgb(ImageOps.exif_transpose(image)), (largest, largest), Image.Resampling.LANCZOS)
+
+    variants = {}
+    for size in SIZES:
+        resized = square if size == largest else square.resize((size, size), Image.Resampling.LANCZOS)
+        for key, format, extension, options in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, format, **options)
+            data = buffer.getvalue()
+            variant = f'{VARIANT_DIR}/{hashlib.sha256(data).hexdigest()[:32]}{extension}'
+            if not storage.exists(variant):
+                variant = storage.save(variant, ContentFile(data))
+            variants.setdefault(str(size), {})[key] = variant
+    return variants
@@ -25,4 +25,12 @@ class UserUpdateForm(forms.ModelForm):
 class ProfileUpdateForm(forms.ModelForm):
     class Meta:
         model = Profile
-        fields = ['avatar']
+        fields = ['avatar', 'notification_frequency']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Keep the current preference when a client posts only the avatar
+        self.fields['notification_frequency'].required = False
+
+    def clean_notification_frequency(self):
+        return self.cleaned_data.get('notification_frequency') or self.instance.notification_frequency
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_profile_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notification_frequency',
+            field=models.CharField(choices=[('immediate', 'As they happen'), ('hourly', 'Hourly digest'), ('daily', 'Daily digest')], default='immediate', help_text='How often course updates are emailed to you', max_length=10),
+        ),
+    ]
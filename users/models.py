@@ -3,7 +3,6 @@ from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-from PIL import Image
 from rules.contrib.models import RulesModel
 from rules import Predicate, always_deny, is_authenticated
 
@@ -18,26 +17,51 @@ class Profile(RulesModel):
             'delete': always_deny,
         }
 
+    NOTIFICATION_FREQUENCIES = [
+        ('immediate', 'As they happen'),
+        ('hourly', 'Hourly digest'),
+        ('daily', 'Daily digest'),
+    ]
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
 
     avatar = models.ImageField(
         default='avatar.jpg',  # default avatar
         upload_to='profile_avatars'  # dir to store the image
     )
+    # Resized copies made by users.tasks.process_avatar, see users.avatars
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    notification_frequency = models.CharField(
+        max_length=10,
+        choices=NOTIFICATION_FREQUENCIES,
+        default='immediate',
+        help_text='How often course updates are emailed to you',
+    )
+
+    # Secret in the URL of the user's deadline calendar feed, see uniworld.deadlines
+    calendar_token = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         # noinspection PyUnresolvedReferences
         return f'{self.user.username} Profile'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored avatar so that only a new one gets processed
+        instance._loaded_avatar = instance.__dict__.get('avatar')
+        return instance
+
     def save(self, *args, **kwargs):
-        # save the profile first
+        if self.avatar.name != getattr(self, '_loaded_avatar', None):
+            # The variants were made from the old image
+            self.avatar_variants = {}
         super().save(*args, **kwargs)
 
-        # resize the image
-        img = Image.open(self.avatar.path)
-        if img.height > 300 or img.width > 300:
-            output_size = (300, 300)
-            # create a thumbnail
-            img.thumbnail(output_size)
-            # overwrite the larger image
-            img.save(self.avatar.path)
+    def avatar_urls(self, size):
+        """{'webp': url, 'jpeg': url} for one of avatars.SIZES, or None until the avatar has been processed."""
+        variant = self.avatar_variants.get(str(size))
+        if not variant:
+            return None
+        return {key: self.avatar.storage.url(name) for key, name in variant.items()}
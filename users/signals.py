@@ -1,9 +1,12 @@
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 from django.dispatch import receiver
+from .avatars import DEFAULT_AVATAR
 from .models import Profile
+from .tasks import process_avatar
 
 
 # noinspection PyUnusedLocal
@@ -15,5 +18,16 @@ def create_profile(sender, instance, created, **kwargs):
 
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_profile(sender, instance, update_fields=None, **kwargs):
+    # Partial saves, like the last_login update on every login, never touch the profile
+    if update_fields is None:
+        instance.profile.save()
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Profile)
+def avatar_changed(sender, instance, **kwargs):
+    name = instance.avatar.name
+    if name != getattr(instance, '_loaded_avatar', None) and name != DEFAULT_AVATAR:
+        transaction.on_commit(lambda: process_avatar.delay(instance.pk, name))
+    instance._loaded_avatar = name
@@ -0,0 +1,18 @@
+from celery import shared_task
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .avatars import render
+from .models import Profile
+
+@shared_task
+def process_avatar(profile_id, name):
+    try:
+        variants = render(default_storage, name)
+    except (OSError, Image.DecompressionBombError) as error:
+        # Templates keep showing the original, and retrying won't make it readable
+        print(f"Could not process avatar {name}: {error}")
+        return
+
+    # Skipped if the avatar was replaced again while this one was being processed
+    Profile.objects.filter(pk=profile_id, avatar=name).update(avatar_variants=variants)
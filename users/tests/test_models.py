@@ -1,6 +1,15 @@
-from django.test import TestCase
+import io
+import tempfile
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from PIL import Image
+from users import tasks
 from users.models import Profile
 from rules.contrib.models import RulesModel
 
@@ -46,4 +55,68 @@ class ProfileModelTest(TestCase):
 
         # Test delete permission
         self.assertFalse(self.user.has_perm(Profile.get_perm('delete'), self.profile))
-        self.assertFalse(self.other_user.has_perm(Profile.get_perm('delete'), self.profile))
\ No newline at end of file
+        self.assertFalse(self.other_user.has_perm(Profile.get_perm('delete'), self.profile))
+
+class AvatarPipelineTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.profile = Profile.objects.get(user=self.user)
+
+    def upload(self, colour='red', size=(640, 480)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, colour).save(buffer, 'JPEG')
+        self.profile.avatar = SimpleUploadedFile('me.jpg', buffer.getvalue())
+        with mock.patch.object(tasks.process_avatar, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        return delay
+
+    def test_only_a_new_avatar_is_processed(self):
+        delay = self.upload()
+        delay.assert_called_once_with(self.profile.pk, self.profile.avatar.name)
+
+        with mock.patch.object(tasks.process_avatar, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Renamed'
+            self.user.save()
+            Profile.objects.get(pk=self.profile.pk).save()
+        delay.assert_not_called()
+
+    def test_logins_do_not_save_the_profile(self):
+        with mock.patch.object(Profile, 'save') as save:
+            self.client.login(username='testuser', password='testpass123')
+        save.assert_not_called()
+
+    def test_variants(self):
+        self.upload()
+        tasks.process_avatar(self.profile.pk, self.profile.avatar.name)
+        self.profile.refresh_from_db()
+
+        self.assertEqual(set(self.profile.avatar_variants), {'32', '64', '300'})
+        for size, variant in self.profile.avatar_variants.items():
+            for key, format in [('webp', 'WEBP'), ('jpeg', 'JPEG')]:
+                with Image.open(default_storage.path(variant[key])) as image:
+                    self.assertEqual((image.format, image.size), (format, (int(size), int(size))))
+
+        # Named after their content, so processing the same picture again changes nothing
+        variants = self.profile.avatar_variants
+        tasks.process_avatar(self.profile.pk, self.profile.avatar.name)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_variants, variants)
+
+        html = Template('{% load custom_filters %}{% avatar profile 32 alt="Me" %}').render(Context({'profile': self.profile}))
+        self.assertIn(f'srcset="{default_storage.url(variants["32"]["webp"])}"', html)
+        self.assertIn(f'src="{default_storage.url(variants["32"]["jpeg"])}"', html)
+
+    def test_replaced_avatar_is_not_overwritten_by_a_stale_job(self):
+        self.upload('red')
+        stale = self.profile.avatar.name
+        self.upload('blue')
+        tasks.process_avatar(self.profile.pk, stale)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_variants, {})
+        self.assertIsNone(self.profile.avatar_urls(32))
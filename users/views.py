@@ -5,15 +5,15 @@ from django.contrib.auth.models import Group
 from django.contrib.auth.views import LoginView
 from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.views.generic.edit import FormView
 
 from .forms import RegisterForm, UserUpdateForm, ProfileUpdateForm
 from .permissions import IsOwnerOrReadOnly
 
-from django.utils import timezone
-from uniworld.models import Assignment
+from uniworld import deadlines, membership
+from uniworld.models import Course
 from rest_framework import viewsets
 from rest_framework.response import Response
 from .serializers import UserSerializer, ProfileSerializer
@@ -45,18 +45,20 @@ class ProfileView(LoginRequiredMixin, View):
         user_form = UserUpdateForm(instance=user)
         profile_form = ProfileUpdateForm(instance=user.profile)
 
+        enrolled_course_ids = membership.get_index(user).enrolled
         context = {
             'user_form': user_form,
             'profile_form': profile_form,
             'is_own_profile': is_own_profile,
+            'enrolled_courses': Course.objects.filter(pk__in=enrolled_course_ids).order_by('name'),
         }
 
         if is_own_profile and user.groups.filter(name='students').exists():
-            upcoming_assignments = Assignment.objects.filter(
-                Q(material__course__in=user.enrolled_courses.all()) &
-                Q(due_date__gt=timezone.now())
-            ).order_by('due_date')[:5]  # Get the next 5 upcoming assignments
-            context['upcoming_assignments'] = upcoming_assignments
+            # Served from the per-student cache kept by uniworld.deadlines
+            context['upcoming_assignments'] = deadlines.upcoming(user.pk, limit=5)
+            context['calendar_url'] = request.build_absolute_uri(
+                reverse('deadline-calendar', args=[deadlines.calendar_token(user)])
+            )
 
         return render(request, 'users/profile.html', context)
 
@@ -88,7 +90,8 @@ class ProfileView(LoginRequiredMixin, View):
             context = {
                 'user_form': user_form,
                 'profile_form': profile_form,
-                'is_own_profile': user == request.user
+                'is_own_profile': user == request.user,
+                'enrolled_courses': Course.objects.filter(pk__in=membership.get_index(user).enrolled).order_by('name'),
             }
             messages.error(request, 'Error updating you profile')
 